@@ -0,0 +1,78 @@
+# Micro-benchmark: Message footprint and serialization cost against the
+# original dict-based class.
+#
+#   python benchmarks/bench_message.py [count]
+
+import os
+import pickle
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_message import Message  # noqa: E402
+
+
+class LegacyMessage:
+    # The Message class as it was before it became slotted and immutable.
+    def __init__(self, user: str, text: str, message_type: str, profile: dict = None, attachments: list = None):
+        self.user = user
+        self.text = text
+        self.message_type = message_type
+        self.profile = profile or {}
+        self.attachments = attachments or []
+
+
+def sample_args(i):
+    return (f"student{i % 500}", f"Has anyone finished problem set {i % 12}?", "chat_message")
+
+
+def bytes_per_message(factory, count):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    messages = [factory(*sample_args(i)) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    # Text payloads are identical for both classes, so this is the overhead.
+    del messages
+    return allocated / count
+
+
+def ns_per_call(statement, number, **names):
+    return min(timeit.repeat(statement, globals=names, number=number, repeat=5)) / number * 1e9
+
+
+def main(count=100_000):
+    legacy = LegacyMessage(*sample_args(1))
+    message = Message(*sample_args(1))
+    legacy_wire = pickle.dumps(legacy, protocol=pickle.HIGHEST_PROTOCOL)
+    wire = message.encode()
+    number = 20_000
+    rows = [
+        ("heap bytes / message", bytes_per_message(LegacyMessage, count), bytes_per_message(Message, count)),
+        ("wire bytes / message", len(legacy_wire), len(wire)),
+        (
+            "construct ns",
+            ns_per_call("LegacyMessage(*args)", number, LegacyMessage=LegacyMessage, args=sample_args(1)),
+            ns_per_call("Message(*args)", number, Message=Message, args=sample_args(1)),
+        ),
+        (
+            "encode ns",
+            ns_per_call("dumps(m, 5)", number, dumps=pickle.dumps, m=legacy),
+            ns_per_call("m.encode()", number, m=message),
+        ),
+        (
+            "decode ns",
+            ns_per_call("loads(b)", number, loads=pickle.loads, b=legacy_wire),
+            ns_per_call("decode(b)", number, decode=Message.decode, b=wire),
+        ),
+    ]
+    print(f"{'':24}{'legacy (pickle)':>18}{'Message':>12}")
+    for name, old, new in rows:
+        print(f"{name:24}{old:>18.0f}{new:>12.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
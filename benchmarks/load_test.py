@@ -0,0 +1,381 @@
+# Headless load test: runs main() for N simulated sessions on fake Flet
+# connections with an in-memory users database, replays recorded traffic
+# (chat bursts, polls, votes, events) and checks the results against
+# benchmarks/baseline.json. Exits with status 1 on a regression.
+#
+#   python benchmarks/load_test.py [--sessions 50] [--speed 1.0]
+#                                  [--traffic FILE] [--update-baseline]
+#                                  [--broker]
+#
+# With --broker the sessions share state through an in-process broker, as
+# with CRAMJAM_PUBSUB_BACKEND=broker, and the broker is restarted halfway
+# through the replay so reconnection and re-sync run too.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# Isolated and fast: a throwaway working directory for logs and files, the
+# memory users backend and a cheap KDF. Set before config is imported.
+os.chdir(tempfile.mkdtemp(prefix="cramjam-load-"))
+os.environ.setdefault("CRAMJAM_DB_BACKEND", "memory")
+os.environ.setdefault("CRAMJAM_KDF_ITERATIONS", "10000")
+BROKER = "--broker" in sys.argv
+if BROKER:
+    os.environ["CRAMJAM_PUBSUB_BACKEND"] = "broker"
+    os.environ["CRAMJAM_BROKER_SOCKET"] = os.path.abspath("broker.sock")
+
+import flet as ft  # noqa: E402
+from flet_core.connection import Connection  # noqa: E402
+from flet_core.control_event import ControlEvent  # noqa: E402
+from flet_core.protocol import CommandEncoder  # noqa: E402
+
+import config  # noqa: E402
+import main as app  # noqa: E402
+from broker import Broker  # noqa: E402
+from hubs import get_hub_registry  # noqa: E402
+from users_db import get_users_db  # noqa: E402
+
+BASELINE = os.path.join(HERE, "baseline.json")
+TRAFFIC = os.path.join(HERE, "traffic.jsonl")
+PASSWORD = "load-test-password"
+SIGNIN_TIMEOUT = 60  # Seconds for the whole sign-in burst
+
+# metric -> (better direction, allowed relative regression)
+CHECKS = {
+    "fanout_p95_ms": ("lower", 0.5),
+    "deliveries_per_sec": ("higher", 0.3),
+    "signin_screen_kib": ("lower", 0.2),
+    "session_kib": ("lower", 0.2),
+    "update_bytes_avg": ("lower", 0.2),
+    "signin_p95_ms": ("lower", 0.5),
+}
+
+
+class FakeConnection(Connection):
+    # Accepts every command batch like the Flet server would and measures
+    # the JSON that would have gone over the wire.
+    def __init__(self):
+        super().__init__()
+        self.page_url = "http://localhost"
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.bytes = 0
+
+    def reset(self):
+        with self._lock:
+            self.batches = 0
+            self.bytes = 0
+
+    def send_command(self, session_id, command):
+        return types.SimpleNamespace(result="", error="")
+
+    def send_commands(self, session_id, commands):
+        size = len(json.dumps(commands, cls=CommandEncoder))
+        results = []
+        with self._lock:
+            self.batches += 1
+            self.bytes += size
+            for command in commands:
+                if command.name == "add":
+                    # The server answers an "add" with the id of every control
+                    # in it, keeping the ids of re-added controls
+                    ids = [sub.attrs.get("id") or f"_{next(self._ids)}" for sub in command.commands]
+                    results.append(" ".join(ids))
+        return types.SimpleNamespace(results=results, error="")
+
+
+class InlineExecutor(Executor):
+    # Runs Flet's threaded event handlers inline, so a route change has
+    # finished by the time Session.route() returns.
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as error:
+            future.set_exception(error)
+        return future
+
+
+class Session:
+    def __init__(self, index, conn, loop, executor):
+        self.user = f"student{index:04d}"
+        self.page = ft.Page(conn, f"session-{index}", loop=loop, executor=executor)
+        self.page._set_attr("url", "http://localhost", False)
+        self.controls = {}
+
+    def sign_in(self, password):
+        # Fill in and submit the sign-in form; returns an Event set once the
+        # form has its answer, with the latency and outcome in self.signin
+        self.index_controls()
+        form = self.controls["SignInForm"]
+        self.controls["User Name"].value = self.user
+        self.controls["Password"].value = password
+        done = threading.Event()
+        started = time.perf_counter()
+        on_result = form.on_signin_result
+
+        def record(user, password, found, error):
+            self.signin = ((time.perf_counter() - started) * 1000, found, error)
+            try:
+                on_result(user, password, found, error)
+            finally:
+                done.set()
+
+        form.on_signin_result = record
+        self.controls["Sign in"].on_click(None)
+        return done
+
+    def vote(self, option):
+        # Click an option of the newest poll shown in the chat
+        for control in reversed(self.controls["ListView"].controls):
+            buttons = [child for child in getattr(control, "controls", ()) if isinstance(child, ft.ElevatedButton)]
+            if buttons:
+                buttons[option % len(buttons)].on_click(None)
+                return
+
+    def route(self, route):
+        self.page.route = route
+        handler = self.page.on_route_change.get_handler()
+        event = ControlEvent(target="page", name="route_change", data=route, page=self.page, control=self.page)
+        self.page.loop.run_until_complete(handler(event))
+
+    def index_controls(self):
+        # Inputs by label or hint and buttons by text, as a user would find
+        # them, plus the first control of each class, e.g. "SignInForm"
+        stack = list(self.page.controls)
+        while stack:
+            control = stack.pop()
+            self.controls.setdefault(type(control).__name__, control)
+            for key in ("label", "hint_text", "text"):
+                value = getattr(control, key, None)
+                if isinstance(value, str):
+                    self.controls.setdefault(value, control)
+            for attr in ("controls", "content"):
+                child = getattr(control, attr, None)
+                if isinstance(child, list):
+                    stack.extend(child)
+                elif isinstance(child, ft.Control):
+                    stack.append(child)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def load_traffic(path):
+    with open(path) as traffic:
+        return [json.loads(line) for line in traffic if line.strip()]
+
+
+def start_broker():
+    broker = Broker()
+    threading.Thread(target=broker.serve_forever, name="load-test-broker", daemon=True).start()
+    while True:  # Until it accepts connections
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(broker.path)
+            return broker
+        except OSError:
+            time.sleep(0.01)
+        finally:
+            probe.close()
+
+
+def run(sessions_count, traffic, speed):
+    broker = start_broker() if BROKER else None
+    conn = FakeConnection()
+    loop = asyncio.new_event_loop()
+    hubs = get_hub_registry()
+    db = get_users_db()
+    executor = InlineExecutor()
+    sessions = [Session(index, conn, loop, executor) for index in range(sessions_count)]
+    for session in sessions:
+        db.add_user(session.user, PASSWORD)
+
+    # Sessions: open the sign-in screen, then sign in through the form and
+    # open the chat, measuring memory per session after each step. Every
+    # session submits at once, so sign-ins queue on the database executor as
+    # they would in a login rush.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for session in sessions:
+        app.main(session.page)
+    signin_screen_bytes = (tracemalloc.get_traced_memory()[0] - before) / sessions_count
+    pending = [session.sign_in(PASSWORD) for session in sessions]
+    deadline = time.monotonic() + SIGNIN_TIMEOUT
+    for session, done in zip(sessions, pending):
+        if not done.wait(max(deadline - time.monotonic(), 0)):
+            raise RuntimeError(f"Sign-in timed out for {session.user}")
+        _, found, error = session.signin
+        if not found:
+            raise RuntimeError(f"Sign-in failed for {session.user}: {error or 'rejected'}")
+        session.route("/chat")
+    signin_ms = [session.signin[0] for session in sessions]
+    session_bytes = (tracemalloc.get_traced_memory()[0] - before) / sessions_count
+    tracemalloc.stop()
+
+    # Time every delivery from publish until the session's on_message returns
+    fanout_ms = []
+    published = []
+    last_delivery = [0.0]
+    lock = threading.Lock()
+
+    def timed(handler):
+        def deliver(message):
+            handler(message)
+            with lock:
+                fanout_ms.append((time.time() - message.sent_at) * 1000)
+                last_delivery[0] = time.perf_counter()
+
+        return deliver
+
+    for session in sessions:
+        session.index_controls()
+        # The poll and event forms are built when first opened
+        session.controls["New Poll"].on_click(None)
+        session.controls["New Event"].on_click(None)
+        session.index_controls()
+        queue = hubs._subscribers[config.DEFAULT_HUB][session.page.session_id]
+        queue.handler = timed(queue.handler)
+    hubs.add_listener(published.append)
+    conn.reset()
+
+    # Replay: each op runs on a worker thread at its recorded time
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        started = time.perf_counter()
+        for index, op in enumerate(traffic):
+            if broker is not None and index == len(traffic) // 2:
+                # Workers reconnect and re-send their events and votes
+                broker.close()
+                broker = start_broker()
+            delay = op["at_ms"] / 1000 / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(perform, sessions[op["user"] % sessions_count], op)
+    expected = None
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        with lock:
+            delivered = len(fanout_ms)
+        if delivered == expected:
+            break
+        expected = delivered
+        time.sleep(0.5)
+    elapsed = max(last_delivery[0] - started, 1e-9)
+
+    return {
+        "sessions": sessions_count,
+        "speed": speed,
+        "backend": "broker" if BROKER else "local",
+        "messages_published": len(published),
+        "deliveries": len(fanout_ms),
+        "fanout_p50_ms": round(percentile(fanout_ms, 0.5), 3),
+        "fanout_p95_ms": round(percentile(fanout_ms, 0.95), 3),
+        "fanout_p99_ms": round(percentile(fanout_ms, 0.99), 3),
+        "deliveries_per_sec": round(len(fanout_ms) / elapsed, 1),
+        "signin_screen_kib": round(signin_screen_bytes / 1024, 1),
+        "session_kib": round(session_bytes / 1024, 1),
+        "update_batches": conn.batches,
+        "update_bytes_avg": round(conn.bytes / max(conn.batches, 1), 1),
+        "update_bytes_per_session": round(conn.bytes / sessions_count, 1),
+        "signin_p50_ms": round(percentile(signin_ms, 0.5), 3),
+        "signin_p95_ms": round(percentile(signin_ms, 0.95), 3),
+    }
+
+
+def perform(session, op):
+    controls = session.controls
+    try:
+        if op["op"] == "chat":
+            controls["Write a message..."].value = op["text"]
+            controls["Write a message..."].on_submit(None)
+        elif op["op"] == "poll":
+            controls["Poll Question"].value = op["question"]
+            controls["Poll Options (comma-separated)"].value = ", ".join(op["options"])
+            controls["Create Poll"].on_click(None)
+        elif op["op"] == "vote":
+            session.vote(op["option"])
+        elif op["op"] == "event":
+            controls["Event Name"].value = op["name"]
+            controls["Venue"].value = op["venue"]
+            controls["Time"].value = op["time"]
+            controls["Hub Name"].value = config.DEFAULT_HUB
+            controls["Description"].value = op["description"]
+            controls["Create Event"].on_click(None)
+    except Exception as error:
+        print(f"{op['op']} by {session.user} failed: {error}")
+
+
+def compare(results, baseline):
+    # Returns the list of regressions past each metric's tolerance
+    failures = []
+    for metric, (direction, tolerance) in CHECKS.items():
+        expected = baseline.get(metric)
+        if not expected:
+            continue
+        actual = results[metric]
+        if direction == "lower" and actual > expected * (1 + tolerance):
+            failures.append(f"{metric}: {actual} > {expected} + {tolerance:.0%}")
+        elif direction == "higher" and actual < expected * (1 - tolerance):
+            failures.append(f"{metric}: {actual} < {expected} - {tolerance:.0%}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless CramJam load test")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up factor")
+    parser.add_argument("--traffic", default=TRAFFIC)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--broker", action="store_true", help="share state through a broker and restart it midway")
+    args = parser.parse_args()
+
+    results = run(args.sessions, load_traffic(args.traffic), args.speed)
+    for metric, value in results.items():
+        print(f"{metric:>26}: {value}")
+
+    if args.update_baseline:
+        with open(BASELINE, "w") as baseline:
+            json.dump(results, baseline, indent=2)
+            baseline.write("\n")
+        print(f"Baseline written to {BASELINE}")
+        return 0
+    try:
+        with open(BASELINE) as baseline:
+            expected = json.load(baseline)
+    except FileNotFoundError:
+        print("No baseline yet; run with --update-baseline to record one.")
+        return 0
+    recorded = (expected.get("sessions"), expected.get("speed"), expected.get("backend", "local"))
+    if recorded != (results["sessions"], results["speed"], results["backend"]):
+        print(
+            f"Baseline was recorded with {recorded[0]} sessions at speed {recorded[1]} "
+            f"on the {recorded[2]} backend; not comparing."
+        )
+        return 0
+    failures = compare(results, expected)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
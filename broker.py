@@ -0,0 +1,599 @@
+import itertools
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+
+import config
+import metrics
+from chat_message import Message
+from event_store import Event, EventStore, get_event_store
+from hubs import DeliveryQueue, HubRegistry, get_hub_registry
+from polls import PollEngine, get_poll_engine
+from presence import SYNC, PresenceTracker, get_presence_tracker, presence_messages
+
+log = logging.getLogger(__name__)
+
+# Shared state for several worker processes. Run one broker per host with
+# `python broker.py` and start the workers with CRAMJAM_PUBSUB_BACKEND=broker.
+# The broker owns the hub logs, poll counts and the event list; workers keep
+# local copies for rendering and send every change through the broker, which
+# applies it once and fans it out to all workers in one order. A worker that
+# loses the broker keeps retrying, and on reconnecting re-sends its events,
+# the votes cast through it and who is online there, so a restarted broker
+# recovers that state.
+
+# Frame: payload length, kind, request id (0 unless a request or its reply)
+_FRAME = struct.Struct("<IBI")
+_LENGTH = struct.Struct("<I")
+
+PUBLISH = 1  # worker -> broker: persist flag + encoded Message
+DELIVER = 2  # broker -> workers: persisted flag + encoded Message
+EVENT = 3  # both ways: an Event as JSON
+REQUEST = 4  # worker -> broker: JSON {"op": ..., ...}
+REPLY = 5  # broker -> worker: op-specific payload
+POLL = 6  # worker -> broker, on reconnect: a poll and the votes cast through that worker, as JSON
+PRESENCE = 7  # worker -> broker, on reconnect: {hub: [users]} online there; broker -> worker: {hub: {user: workers}}
+
+_RECONNECT_MIN = 0.1  # seconds before the first reconnection attempt
+
+
+class BrokerUnavailableError(ConnectionError):
+    # Raised instead of blocking while a worker is not connected to the broker
+    pass
+
+
+def _send(sock, lock, kind, payload=b"", request_id=0):
+    frame = _FRAME.pack(len(payload), kind, request_id) + payload
+    with lock:
+        sock.sendall(frame)
+
+
+def _frames(stream):
+    # Yields (kind, request_id, payload) until the connection closes
+    while True:
+        header = stream.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            return
+        length, kind, request_id = _FRAME.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length:
+            return
+        yield kind, request_id, payload
+
+
+def _pack_messages(messages):
+    return b"".join(_LENGTH.pack(len(data)) + data for data in (message.encode() for message in messages))
+
+
+def _unpack_messages(data):
+    messages = []
+    offset = 0
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        messages.append(Message.decode(data[offset:offset + length]))
+        offset += length
+    return messages
+
+
+def _event_to_json(event):
+    fields = event._asdict()
+    fields["starts_at"] = event.starts_at.isoformat()
+    return json.dumps(fields).encode()
+
+
+def _event_from_json(data):
+    fields = json.loads(data)
+    fields["starts_at"] = datetime.fromisoformat(fields["starts_at"])
+    return Event(**fields)
+
+
+class Broker:
+    # One thread per connected worker. Publishes are sequenced under one
+    # lock so every worker sees a hub's messages in seq order.
+    def __init__(self, path=None):
+        self.path = path or config.BROKER_SOCKET
+        self.hubs = HubRegistry()
+        self.polls = PollEngine(lambda message: self.broadcast(DELIVER, b"\0" + message.encode()))
+        self.events = EventStore()
+        self._workers = {}  # socket -> send lock
+        self._presence = {}  # socket -> {hub: users online through that worker}
+        self._server = None
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Left behind by a previous broker
+        self._server = server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        log.info("Broker listening on %s", self.path)
+        while True:
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                return  # Closed by close()
+            threading.Thread(target=self._serve, args=(sock,), name="broker-worker", daemon=True).start()
+
+    def close(self):
+        # Stops accepting and drops every worker, like a broker restart
+        if self._server is not None:
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)  # Wakes the blocked accept()
+            except OSError:
+                pass
+            self._server.close()
+        with self._lock:
+            workers = list(self._workers)
+        for sock in workers:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def broadcast(self, kind, payload):
+        with self._lock:
+            workers = list(self._workers.items())
+        for sock, lock in workers:
+            try:
+                _send(sock, lock, kind, payload)
+            except OSError:
+                pass  # Its connection thread notices and drops it
+
+    def _serve(self, sock):
+        lock = threading.Lock()
+        try:
+            # A new worker starts from the current events, poll counts and
+            # roster. Registering under the same locks means no later change
+            # is missed.
+            with self._publish_lock, self._lock:
+                for event in self.events.all():
+                    _send(sock, lock, EVENT, _event_to_json(event))
+                for poll in self.polls.polls():
+                    _send(sock, lock, DELIVER, b"\0" + self.polls.results_message(poll).encode())
+                _send(sock, lock, PRESENCE, json.dumps(self._roster()).encode())
+                self._workers[sock] = lock
+            for kind, request_id, payload in _frames(sock.makefile("rb")):
+                try:
+                    self._handle(sock, lock, kind, request_id, payload)
+                except OSError:
+                    raise
+                except Exception:
+                    log.exception("Broker could not handle a frame of kind %s", kind)
+        except OSError:
+            pass
+        finally:
+            # Its users leave, unless another worker still has them
+            with self._publish_lock:
+                with self._lock:
+                    self._workers.pop(sock, None)
+                for hub, users in list(self._presence.get(sock, {}).items()):
+                    self._update_presence(sock, hub, dict.fromkeys(users, -1))
+                self._presence.pop(sock, None)
+            sock.close()
+
+    def _roster(self):
+        # hub -> {user: workers reporting them online}
+        roster = {}
+        for hubs in self._presence.values():
+            for hub, users in hubs.items():
+                counts = roster.setdefault(hub, {})
+                for user in users:
+                    counts[user] = counts.get(user, 0) + 1
+        return roster
+
+    def _update_presence(self, sock, hub, changes, ref=""):
+        # Called under _publish_lock. Applies {user: +1 or -1} to what sock's
+        # worker has online in hub and passes on the changes that were new.
+        # Users still online through another worker are passed on silently.
+        users = self._presence.setdefault(sock, {}).setdefault(hub, set())
+        applied = {}
+        for user, change in changes.items():
+            if (change > 0) != (user in users):
+                if change > 0:
+                    users.add(user)
+                else:
+                    users.discard(user)
+                applied[user] = change
+        if not users:
+            del self._presence[sock][hub]
+        elsewhere = set()
+        for other, hubs in self._presence.items():
+            if other is not sock:
+                elsewhere.update(hubs.get(hub, ()))
+        shown = {user: change for user, change in applied.items() if user not in elsewhere}
+        hidden = {user: change for user, change in applied.items() if user in elsewhere}
+        for message in itertools.chain(presence_messages(hub, shown, ref), presence_messages(hub, hidden, SYNC)):
+            self.broadcast(DELIVER, b"\0" + message.encode())
+
+    def _handle(self, sock, lock, kind, request_id, payload):
+        if kind == PUBLISH:
+            message = Message.decode(payload[1:])
+            if message.message_type == "login_message" and not payload[0]:
+                changes = {change[1:]: 1 if change[0] == "+" else -1 for change in message.attachments}
+                with self._publish_lock:
+                    self._update_presence(sock, message.hub, changes, message.ref)
+                return
+            if message.message_type == "poll":
+                self.polls.ensure(message)
+            with self._publish_lock:
+                if payload[0]:
+                    message = self.hubs.with_log(message.hub, lambda log: log.append(message))
+                self.broadcast(DELIVER, payload[:1] + message.encode())
+        elif kind == EVENT:
+            # Re-sent events the broker already has are not passed on again
+            event = _event_from_json(payload)
+            with self._publish_lock:
+                if self.events.get(event.event_id) is not None:
+                    return
+                self.events.add(event)
+                self.broadcast(EVENT, payload)
+        elif kind == POLL:
+            state = json.loads(payload)
+            self.polls.ensure(_poll_message(state))
+            self.polls.restore_votes(state["poll_id"], state["voters"])
+        elif kind == PRESENCE:
+            # The worker's whole membership; only the difference is passed on
+            online = {hub: set(users) for hub, users in json.loads(payload).items()}
+            with self._publish_lock:
+                known = self._presence.get(sock, {})
+                for hub in set(known) | set(online):
+                    before, after = known.get(hub, set()), online.get(hub, set())
+                    changes = dict.fromkeys(after - before, 1)
+                    changes.update(dict.fromkeys(before - after, -1))
+                    self._update_presence(sock, hub, changes, SYNC)
+        elif kind == REQUEST:
+            _send(sock, lock, REPLY, self._answer(json.loads(payload)), request_id)
+
+    def _answer(self, request):
+        op = request["op"]
+        if op == "range":
+            messages = self.hubs.with_log(request["hub"], lambda log: log.read_range(request["start"], request["end"]))
+            return _pack_messages(messages)
+        if op == "tail":
+            return _pack_messages(self.hubs.with_log(request["hub"], lambda log: log.tail(request["count"])))
+        if op == "bounds":
+            bounds = self.hubs.with_log(request["hub"], lambda log: [log.first_seq, log.last_seq])
+            return json.dumps(bounds).encode()
+        if op == "hubs":
+            return json.dumps(self.hubs.known_hubs()).encode()
+        if op == "vote":
+            # A poll the broker lost in a restart, and no worker has re-sent
+            # yet, is rebuilt from the voter's copy
+            self.polls.ensure(_poll_message(request))
+            return json.dumps(self.polls.vote(request["poll_id"], request["user"], request["option"])).encode()
+        raise ValueError(f"Unknown broker request: {op}")
+
+
+def _poll_message(state):
+    # The "poll" message a poll is rebuilt from, given its JSON description
+    return Message(
+        user="",
+        text=state["question"],
+        message_type="poll",
+        attachments=state["options"],
+        hub=state["hub"],
+        ref=state["poll_id"],
+    )
+
+
+class BrokerClient:
+    # A worker's connection to the broker. One reader thread applies
+    # deliveries and events and hands replies to waiting requests. When the
+    # connection drops, it reconnects with exponential backoff and then runs
+    # the on_connect() callbacks, which re-sync local state with a broker
+    # that may have restarted empty. While disconnected, send() and
+    # request() raise BrokerUnavailableError straight away.
+    def __init__(self, path=None, timeout_ms=None, reconnect_max_ms=None):
+        self.path = path or config.BROKER_SOCKET
+        self.timeout = (timeout_ms or config.BROKER_TIMEOUT_MS) / 1000
+        self.reconnect_max = (reconnect_max_ms or config.BROKER_RECONNECT_MAX_MS) / 1000
+        self.sock = None  # None while disconnected
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._replies = {}  # request_id -> [threading.Event, payload]
+        self._callbacks = []
+        self._thread = None
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def on_connect(self, callback):
+        # callback() runs on its own thread after every reconnection
+        self._callbacks.append(callback)
+
+    def start(self):
+        try:
+            self._connect()
+        except OSError as error:
+            log.warning("Broker at %s is unavailable (%s); retrying in the background", self.path, error)
+        self._thread = threading.Thread(target=self._run, name="broker-client", daemon=True)
+        self._thread.start()
+
+    def send(self, kind, payload, request_id=0):
+        sock = self.sock
+        if sock is None:
+            raise BrokerUnavailableError("Not connected to the broker")
+        try:
+            _send(sock, self._send_lock, kind, payload, request_id)
+        except OSError as error:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # So the reader reconnects
+            except OSError:
+                pass
+            raise BrokerUnavailableError("Lost the connection to the broker") from error
+
+    def request(self, op, **args):
+        request_id = next(self._ids)
+        waiter = self._replies[request_id] = [threading.Event(), None]
+        try:
+            self.send(REQUEST, json.dumps(dict(args, op=op)).encode(), request_id)
+        except BrokerUnavailableError:
+            self._replies.pop(request_id, None)
+            raise
+        if not waiter[0].wait(self.timeout):
+            self._replies.pop(request_id, None)
+            raise TimeoutError(f"Broker did not answer {op} in time")
+        if waiter[1] is None:
+            raise BrokerUnavailableError(f"Lost the connection to the broker during {op}")
+        return waiter[1]
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        # Not on the reader thread: the broker sends its own state first and
+        # only reads ours once we have taken that in
+        threading.Thread(target=self._resync, name="broker-resync", daemon=True).start()
+
+    def _resync(self):
+        for callback in list(self._callbacks):
+            try:
+                callback()
+            except Exception:
+                log.exception("Could not re-sync with the broker")
+
+    def _run(self):
+        delay = _RECONNECT_MIN
+        while True:
+            if self.sock is None:
+                time.sleep(delay)
+                try:
+                    self._connect()
+                except OSError:
+                    delay = min(delay * 2, self.reconnect_max)
+                    continue
+                log.info("Reconnected to the broker")
+                delay = _RECONNECT_MIN
+            self._read(self.sock)
+            self._disconnected()
+
+    def _disconnected(self):
+        log.error("Lost the connection to the broker; reconnecting")
+        sock, self.sock = self.sock, None
+        sock.close()
+        # Requests in flight will not be answered; wake them with no payload
+        for request_id in list(self._replies):
+            waiter = self._replies.pop(request_id, None)
+            if waiter is not None:
+                waiter[0].set()
+
+    def _read(self, sock):
+        try:
+            for kind, request_id, payload in _frames(sock.makefile("rb")):
+                self._apply(kind, request_id, payload)
+        except OSError:
+            pass  # Reset by the other end, or shut down by send()
+
+    def _apply(self, kind, request_id, payload):
+        try:
+            if kind == REPLY:
+                waiter = self._replies.pop(request_id, None)
+                if waiter is not None:
+                    waiter[1] = payload
+                    waiter[0].set()
+            elif kind == DELIVER:
+                message = Message.decode(payload[1:])
+                if message.message_type == "poll_results":
+                    get_poll_engine().apply_results(message)
+                get_hub_registry().deliver(message, persisted=bool(payload[0]))
+            elif kind == EVENT:
+                get_event_store().replicate(_event_from_json(payload))
+            elif kind == PRESENCE:
+                get_presence_tracker().reset(json.loads(payload))
+        except Exception:
+            log.exception("Could not apply a broker frame of kind %s", kind)
+
+
+class RemoteLog:
+    # The part of MessageLog that sessions read, served by the broker
+    def __init__(self, client, hub):
+        self.client = client
+        self.hub = hub
+
+    def _bounds(self):
+        return json.loads(self.client.request("bounds", hub=self.hub))
+
+    @property
+    def first_seq(self):
+        return self._bounds()[0]
+
+    @property
+    def last_seq(self):
+        return self._bounds()[1]
+
+    def read_range(self, start_seq, end_seq):
+        return _unpack_messages(self.client.request("range", hub=self.hub, start=start_seq, end=end_seq))
+
+    def tail(self, count):
+        return _unpack_messages(self.client.request("tail", hub=self.hub, count=count))
+
+    def before(self, seq, count):
+        return self.read_range(max(seq - count, 1), seq)
+
+
+class RemoteHubRegistry(HubRegistry):
+    # Subscriptions stay local to the worker. Publishing goes to the broker,
+    # which stores the message and sends it back to every worker, this one
+    # included, for delivery. publish() raises BrokerUnavailableError while
+    # the broker is unreachable.
+    def __init__(self, client=None):
+        super().__init__()
+        self.client = client or get_broker_client()
+        self.client.on_connect(self._resync)
+
+    def _resync(self):
+        # Deliveries may have been missed while disconnected, so the replay
+        # buffers reload from the broker when next read, and every session
+        # still subscribed here is caught up from them
+        with self._lock:
+            self._replay.clear()
+            handlers = [handler for handlers in self._subscribers.values() for handler in handlers.values()]
+        for handler in handlers:
+            if isinstance(handler, DeliveryQueue):
+                handler.gap()
+
+    def history(self, hub):
+        return RemoteLog(self.client, hub)
+
+    def known_hubs(self):
+        return json.loads(self.client.request("hubs"))
+
+    def publish(self, message, persist=True):
+        # Returned unstamped: the seq arrives with the delivery
+        metrics.PUBLISHED.inc(message.message_type)
+        self.client.send(PUBLISH, (b"\1" if persist else b"\0") + message.encode())
+        return message
+
+
+class RemotePollEngine(PollEngine):
+    # Votes are counted by the broker so each user votes once across all
+    # workers; the counts come back as poll_results deliveries. The votes
+    # cast through this worker are kept in each poll's voters and re-sent on
+    # reconnection, so a restarted broker rebuilds the counts from the
+    # workers.
+    def __init__(self, publish, interval_ms=None, client=None):
+        super().__init__(publish, interval_ms)
+        self.client = client or get_broker_client()
+        self._results = {}  # poll_id -> counts, for polls not rendered here yet
+        self.client.on_connect(self._resync)
+
+    def _resync(self):
+        for poll in self.polls():
+            with poll.lock:
+                voters = dict(poll.voters)
+            state = {
+                "poll_id": poll.poll_id,
+                "question": poll.question,
+                "options": list(poll.options),
+                "hub": poll.hub,
+                "voters": voters,
+            }
+            self.client.send(POLL, json.dumps(state).encode())
+
+    def ensure(self, message):
+        poll = super().ensure(message)
+        counts = self._results.pop(message.ref, None)
+        if counts is not None:
+            with poll.lock:
+                poll.counts = counts
+        return poll
+
+    def vote(self, poll_id, user, option):
+        poll = self._polls.get(poll_id)
+        if poll is None or option not in poll.options:
+            return False
+        reply = self.client.request(
+            "vote",
+            poll_id=poll_id,
+            question=poll.question,
+            options=poll.options,
+            hub=poll.hub,
+            user=user,
+            option=option,
+        )
+        if not json.loads(reply):
+            return False
+        with poll.lock:
+            poll.voters[user] = poll.options.index(option)
+        return True
+
+    def apply_results(self, message):
+        counts = [int(count) for count in message.attachments]
+        poll = self._polls.get(message.ref)
+        if poll is None:
+            self._results[message.ref] = counts
+            return
+        with poll.lock:
+            poll.counts = counts
+
+
+class RemoteEventStore(EventStore):
+    # Events added here are sent to the broker, which passes them on to the
+    # other workers, and stored locally. Every local event is re-sent on
+    # reconnection; the broker ignores the ones it already has.
+    def __init__(self, client=None):
+        super().__init__()
+        self.client = client or get_broker_client()
+        self._replicate_lock = threading.Lock()
+        self.client.on_connect(self._resync)
+
+    def add(self, event):
+        # Sent first, so nothing is stored while the broker is unreachable
+        self.client.send(EVENT, _event_to_json(event))
+        self.replicate(event)
+
+    def replicate(self, event):
+        # The broker echoes our own events back, possibly before add() returns
+        with self._replicate_lock:
+            if self.get(event.event_id) is None:
+                super().add(event)
+
+    def _resync(self):
+        for event in self.all():
+            self.client.send(EVENT, _event_to_json(event))
+
+
+class RemotePresenceTracker(PresenceTracker):
+    # The broker keeps who is online through each worker, passes on only the
+    # changes it did not have and sends a connecting worker the roster of all
+    # of them. On reconnection this worker re-sends its whole membership,
+    # which a restarted broker has lost.
+    def __init__(self, publish, interval_ms=None, client=None):
+        super().__init__(publish, interval_ms)
+        self.client = client or get_broker_client()
+        self.client.on_connect(self._resync)
+
+    def _resync(self):
+        self.client.send(PRESENCE, json.dumps(self.members_here()).encode())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_broker_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = BrokerClient()
+                client.start()
+                _client = client
+    return _client
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=config.LOGGING_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    Broker().serve_forever()
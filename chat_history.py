@@ -0,0 +1,159 @@
+import threading
+from collections import deque
+from itertools import islice
+
+import flet as ft
+
+import config
+
+
+class ChatWindow:
+    # Keeps at most `max_live` rendered controls in a ListView. Every message
+    # is kept in a bounded backing store as the Message object itself (shared
+    # by all sessions), and only the visible window is rendered. Scrolling to
+    # either end pages neighbouring messages in and drops the same number of
+    # controls from the other end. While the store has room, scrolling past
+    # its oldest message asks `history(before_seq, count)` for more.
+    # Deliveries, scrolling and reconnects call in from different threads,
+    # so every change to the store, the window and the controls is made
+    # under one lock; pass the page's UpdateScheduler.controls_lock so that
+    # page updates never read the controls mid-change. history() is called
+    # without it, since it may wait on the broker; when it fails,
+    # on_error(error) is called instead.
+    def __init__(
+        self, list_view, render, history=None, max_live=None, page_size=None, max_stored=None, on_error=None, lock=None
+    ):
+        self.list_view = list_view
+        self.render = render  # Message -> control, or None to skip it
+        self.history = history
+        self.on_error = on_error
+        self.max_live = max_live or config.CHAT_WINDOW_SIZE
+        self.page_size = page_size or config.CHAT_PAGE_SIZE
+        self.store = deque(maxlen=max_stored or config.CHAT_STORED_MESSAGES)
+        self.start = 0  # store index of the first message in the window
+        self.end = 0  # store index just past the last message in the window
+        self._last_seq = 0  # Highest persisted seq seen; transient messages have 0
+        self._lock = lock or threading.RLock()
+        list_view.on_scroll = self.on_scroll
+        list_view.on_scroll_interval = 100
+
+    @property
+    def last_seq(self):
+        # The newest persisted message this window has seen
+        return self._last_seq
+
+    @property
+    def following(self):
+        return self.end == len(self.store)
+
+    def add(self, message):
+        with self._lock:
+            self._add(message)
+
+    def _add(self, message):
+        was_following = self.following
+        if len(self.store) == self.store.maxlen:
+            # The oldest stored message is about to fall out of the store.
+            if self.start == 0 and self.end > 0:
+                del self.list_view.controls[0]
+            self.start = max(self.start - 1, 0)
+            self.end = max(self.end - 1, 0)
+        self.store.append(message)
+        self._last_seq = max(self._last_seq, message.seq)
+        if was_following:
+            self._append_window(1)
+
+    def extend(self, messages):
+        # Bulk load, e.g. history replay: only the newest window is rendered.
+        messages = list(messages)
+        with self._lock:
+            if not self.following:
+                for message in messages:
+                    self._add(message)
+                return
+            self.store.extend(messages)
+            self._last_seq = max([self._last_seq, *(message.seq for message in messages)])
+            self.end = len(self.store)
+            self.start = max(self.end - self.max_live, 0)
+            self.list_view.controls[:] = self._render(islice(self.store, self.start, self.end))
+            self.list_view.auto_scroll = True
+
+    def clear(self):
+        with self._lock:
+            self.store.clear()
+            self.start = self.end = self._last_seq = 0
+            self.list_view.controls.clear()
+
+    def on_scroll(self, e):
+        if e.event_type != "end":
+            return
+        if e.pixels <= e.min_scroll_extent:
+            with self._lock:
+                request = self._history_request() if self.start == 0 else None
+            if request is not None:
+                self._load_history(*request)
+            with self._lock:
+                if self.start == 0:
+                    return
+                self._page_older()
+        else:
+            with self._lock:
+                if e.pixels < e.max_scroll_extent or self.following:
+                    return
+                self._append_window(self.page_size)
+        with self._lock:
+            self.list_view.update()
+
+    def _history_request(self):
+        # (history, before_seq, count) for the page before the store, or None
+        room = min(self.page_size, self.store.maxlen - len(self.store))
+        if not self.history or not self.store or room <= 0:
+            return None
+        return self.history, self.store[0].seq, room
+
+    def _load_history(self, history, before_seq, count):
+        try:
+            older = history(before_seq, count)
+        except (ConnectionError, TimeoutError) as error:
+            if self.on_error is not None:
+                self.on_error(error)
+            return
+        with self._lock:
+            # Dropped if the window was cleared or switched hubs meanwhile
+            if history is not self.history or not self.store or self.store[0].seq != before_seq:
+                return
+            room = self.store.maxlen - len(self.store)
+            older = older[max(len(older) - room, 0):]
+            self.store.extendleft(reversed(older))
+            self.start += len(older)
+            self.end += len(older)
+
+    def _render(self, messages):
+        controls = []
+        for message in messages:
+            control = self.render(message)
+            # Keep controls aligned with store indexes even for messages
+            # that render to nothing.
+            controls.append(control if control is not None else ft.Container(visible=False))
+        return controls
+
+    def _append_window(self, count):
+        count = min(count, len(self.store) - self.end)
+        self.list_view.controls.extend(self._render(islice(self.store, self.end, self.end + count)))
+        self.end += count
+        overflow = self.end - self.start - self.max_live
+        if overflow > 0:
+            del self.list_view.controls[:overflow]
+            self.start += overflow
+        self.list_view.auto_scroll = self.following
+
+    def _page_older(self):
+        count = min(self.page_size, self.start)
+        self.list_view.controls[0:0] = self._render(islice(self.store, self.start - count, self.start))
+        self.start -= count
+        overflow = self.end - self.start - self.max_live
+        if overflow > 0:
+            del self.list_view.controls[-overflow:]
+            self.end -= overflow
+        self.list_view.auto_scroll = self.following
+
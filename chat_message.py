@@ -1,21 +1,147 @@
 import flet as ft
+import json
+import logging
+import os
+import struct
+import time
 import webbrowser
+from sys import intern
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
 
+import config
+import user_style
+from file_store import get_file_store
 
-class Message:
-    def __init__(self, user: str, text: str, message_type: str, profile: dict = None, attachments: list = None):
-        self.user = user
-        self.text = text
-        self.message_type = message_type  # e.g., 'text', 'poll', 'event', 'file', 'link'
-        self.profile = profile or {}  # { "major": "", "year": "", "interests": [] }
-        self.attachments = attachments or []
+log = logging.getLogger(__name__)
+
+DEFAULT_HUB = intern(config.DEFAULT_HUB)
+
+# Shared, read-only defaults so messages without a profile or attachments
+# don't each allocate an empty dict and list.
+_EMPTY_PROFILE = MappingProxyType({})
+_EMPTY_ATTACHMENTS = ()
+
+# Binary layout: a fixed header (version, seq, sent_at, then the byte length
+# of user, message_type, hub, ref, text, profile and the attachment count), one
+# u16 length per attachment, then all UTF-8 payloads back to back. seq sits
+# at a fixed offset so the log can stamp an encoded message in place.
+_WIRE_VERSION = 1
+_HEADER = struct.Struct("<BQdHBHBIIH")
+SEQ_OFFSET = 1
+# The largest UTF-8 length each field's header slot can hold
+_MAX_SHORT = 0xFF  # message_type, ref
+_MAX_LONG = 0xFFFF  # user, hub, each attachment, and the attachment count
+
+
+def _check_length(field, value, limit):
+    # UTF-8 takes at most 4 bytes per character, so short values, i.e.
+    # nearly all of them, are accepted without encoding them
+    if len(value) * 4 > limit and len(value.encode()) > limit:
+        raise ValueError(f"Message {field} is longer than {limit} bytes")
+
+
+class _MessageFields(NamedTuple):
+    user: str
+    text: str
+    message_type: str  # e.g., 'text', 'poll', 'event', 'file', 'link'
+    profile: Mapping  # { "major": "", "year": "", "interests": [] }
+    attachments: tuple
+    hub: str  # Topic the message is published to
+    seq: int  # Position in the hub's message log, 0 until published
+    sent_at: float
+    ref: str  # Id of the poll, event or file the message refers to
+
+
+class Message(_MessageFields):
+    # Immutable and compact: one instance is shared by every session that
+    # renders it. Use replace() to derive a changed copy.
+    __slots__ = ()
+
+    def __new__(cls, user: str, text: str, message_type: str, profile: dict = None, attachments: list = None, hub: str = None, seq: int = 0, sent_at: float = None, ref: str = ""):
+        # Fields the wire format cannot hold raise ValueError here rather
+        # than a struct.error when the message is first encoded
+        _check_length("user", user, _MAX_LONG)
+        _check_length("type", message_type, _MAX_SHORT)
+        _check_length("ref", ref, _MAX_SHORT)
+        if hub:
+            _check_length("hub", hub, _MAX_LONG)
+        if attachments:
+            if len(attachments) > _MAX_LONG:
+                raise ValueError(f"Message has more than {_MAX_LONG} attachments")
+            for attachment in attachments:
+                _check_length("attachment", attachment, _MAX_LONG)
+        return tuple.__new__(
+            cls,
+            (
+                intern(user),
+                text,
+                intern(message_type),
+                MappingProxyType(dict(profile)) if profile else _EMPTY_PROFILE,
+                tuple(attachments) if attachments else _EMPTY_ATTACHMENTS,
+                intern(hub) if hub else DEFAULT_HUB,
+                seq,
+                time.time() if sent_at is None else sent_at,
+                ref,
+            ),
+        )
+
+    def replace(self, **changes):
+        return self._replace(**changes)
+
+    def encode(self) -> bytes:
+        user = self.user.encode()
+        message_type = self.message_type.encode()
+        hub = self.hub.encode()
+        ref = self.ref.encode()
+        text = self.text.encode()
+        profile = json.dumps(dict(self.profile), separators=(",", ":")).encode() if self.profile else b""
+        attachments = [attachment.encode() for attachment in self.attachments]
+        header = _HEADER.pack(
+            _WIRE_VERSION, self.seq, self.sent_at,
+            len(user), len(message_type), len(hub), len(ref), len(text), len(profile), len(attachments),
+        )
+        lengths = struct.pack(f"<{len(attachments)}H", *map(len, attachments))
+        return b"".join((header, lengths, user, message_type, hub, ref, text, profile, *attachments))
+
+    @classmethod
+    def decode(cls, data) -> "Message":
+        data = bytes(data)
+        version, seq, sent_at, n_user, n_type, n_hub, n_ref, n_text, n_profile, count = _HEADER.unpack_from(data)
+        if version != _WIRE_VERSION:
+            raise ValueError(f"Unsupported message encoding version {version}")
+        lengths = struct.unpack_from(f"<{count}H", data, _HEADER.size)
+        offset = _HEADER.size + 2 * count
+        end = offset + n_user
+        user = data[offset:end].decode()
+        offset, end = end, end + n_type
+        message_type = data[offset:end].decode()
+        offset, end = end, end + n_hub
+        hub = data[offset:end].decode()
+        offset, end = end, end + n_ref
+        ref = data[offset:end].decode()
+        offset, end = end, end + n_text
+        text = data[offset:end].decode()
+        offset, end = end, end + n_profile
+        profile = json.loads(data[offset:end]) if n_profile else None
+        attachments = []
+        for length in lengths:
+            offset, end = end, end + length
+            attachments.append(data[offset:end].decode())
+        return cls(user, text, message_type, profile, attachments, hub, seq, sent_at, ref)
 
 
 class ChatMessage(ft.Row):
-    def __init__(self, message: Message):
+    def __init__(self, message: Message, context=None):
+        # Imported here because renderers depends on Message
+        from renderers import RenderContext, render
+
         super().__init__()
         self.message = message
         self.vertical_alignment = "start"
+        if context is None:
+            context = RenderContext(download=self.download_file, open_link=self.open_link)
+        content = render(message, context)
         self.controls = [
             ft.CircleAvatar(
                 content=ft.Text(self.get_initials(message.user)),
@@ -23,121 +149,29 @@ class ChatMessage(ft.Row):
                 bgcolor=self.get_avatar_color(message.user),
                 tooltip=self.get_profile_tooltip(message.profile),
             ),
-            self.get_message_content(message),
+            content if content is not None else ft.Text("Unsupported message type."),
         ]
 
-    def get_message_content(self, message: Message):
-        if message.message_type == "text":
-            return ft.Column(
-                [
-                    ft.Text(message.user, weight="bold"),
-                    ft.Text(message.text, selectable=True),
-                ],
-                tight=True,
-                spacing=5,
-            )
-        elif message.message_type == "file":
-            return ft.Column(
-                [
-                    ft.Text(message.user, weight="bold"),
-                    ft.Text(f"File shared: {message.text}", selectable=True),
-                    ft.Row(
-                        [
-                            ft.TextButton(
-                                text=attachment,
-                                on_click=lambda e, a=attachment: self.download_file(a),
-                            )
-                            for attachment in message.attachments
-                        ]
-                    ),
-                ],
-                tight=True,
-                spacing=5,
-            )
-        elif message.message_type == "poll":
-            return ft.Column(
-                [
-                    ft.Text(message.user, weight="bold"),
-                    ft.Text("Poll: " + message.text),
-                    ft.Row(
-                        [
-                            ft.ElevatedButton(text=option, on_click=lambda e, o=option: self.vote_poll(o))
-                            for option in message.attachments
-                        ]
-                    ),
-                ],
-                tight=True,
-                spacing=5,
-            )
-        elif message.message_type == "event":
-            return ft.Column(
-                [
-                    ft.Text(message.user, weight="bold"),
-                    ft.Text(f"Event Notification: {message.text}"),
-                ],
-                tight=True,
-                spacing=5,
-            )
-        elif message.message_type == "link":
-            return ft.Column(
-                [
-                    ft.Text(message.user, weight="bold"),
-                    ft.Text(f"Resource Link: {message.text}", selectable=True),
-                    ft.TextButton(
-                        text="Open Link",
-                        on_click=lambda e: self.open_link(message.text),
-                    ),
-                ],
-                tight=True,
-                spacing=5,
-            )
-        else:
-            return ft.Text("Unsupported message type.")
-
     def get_initials(self, user: str):
-        return user[:1].capitalize()
+        return user_style.initials(user)
 
     def get_avatar_color(self, user: str):
-        colors_lookup = [
-            ft.colors.AMBER, ft.colors.BLUE, ft.colors.BROWN, ft.colors.CYAN,
-            ft.colors.GREEN, ft.colors.INDIGO, ft.colors.LIME, ft.colors.ORANGE,
-            ft.colors.PINK, ft.colors.PURPLE, ft.colors.RED, ft.colors.TEAL, ft.colors.YELLOW,
-        ]
-        return colors_lookup[hash(user) % len(colors_lookup)]
+        return user_style.avatar_color(user)
 
     def get_profile_tooltip(self, profile: dict):
-        if not profile:
-            return "No profile details available."
-        return (
-            f"Major: {profile.get('major', 'Unknown')}\n"
-            f"Year: {profile.get('year', 'Unknown')}\n"
-            f"Interests: {', '.join(profile.get('interests', []))}"
-        )
+        return user_style.profile_tooltip(profile)
 
-    def download_file(self, file_name: str):
-        file_path = f"shared_files/{file_name}"
+    def download_file(self, digest: str, file_name: str):
+        # Streams from the content-addressed store; never loads the whole file
+        destination = os.path.join(config.DOWNLOAD_DIR, os.path.basename(file_name))
         try:
-            print(f"Downloading file: {file_name}")
-            with open(file_path, "rb") as file:
-                content = file.read()
-            with open(f"downloads/{file_name}", "wb") as output_file:
-                output_file.write(content)
-            print(f"File {file_name} downloaded successfully.")
+            get_file_store().copy_to(digest, destination)
+            log.info("Downloaded %s to %s", file_name, destination)
         except FileNotFoundError:
-            print(f"File {file_name} not found.")
-
-    def vote_poll(self, poll_id: str, option: str):
-        polls = {"poll_1": {"Option A": 5, "Option B": 3, "Option C": 2}}
-        if poll_id in polls and option in polls[poll_id]:
-            polls[poll_id][option] += 1
-            print(f"Voted for: {option}. Total votes: {polls[poll_id][option]}")
-        else:
-            print("Invalid poll or option.")
+            log.warning("File %s not found", file_name)
 
     def open_link(self, url: str):
-        print(f"Opening link: {url}")
         if url.startswith("http://") or url.startswith("https://"):
             webbrowser.open(url)
-            print(f"Opened {url} in the default web browser.")
         else:
-            print("Invalid URL format.")
+            log.warning("Not opening %r: not an http(s) URL", url)
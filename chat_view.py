@@ -0,0 +1,709 @@
+import logging
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Callable, NamedTuple
+
+import flet as ft
+
+import config
+import metrics
+from broker import BrokerUnavailableError
+from chat_history import ChatWindow
+from chat_message import Message
+from event_store import Event, get_event_store, parse_event_time
+from file_store import QuotaExceededError, get_file_store
+from hubs import DeliveryQueue, InvalidHubNameError, get_hub_registry, normalize_hub
+from polls import format_results, get_poll_engine
+from presence import SYNC, get_presence_tracker
+from rate_limit import get_publish_limiter
+from reminders import get_reminder_scheduler
+from renderers import RenderContext, render
+from search_index import get_search_index
+from sessions import get_session_registry
+
+log = logging.getLogger(__name__)
+
+UNREACHABLE = "Can't reach the chat server right now. Please try again in a moment."
+
+
+class ChatViews(NamedTuple):
+    layout: ft.Control
+    calendar: Callable[[], ft.Control]  # Builds the calendar page on first use
+    suspend: Callable[[], None]  # Stops deliveries while the client is away
+    resume: Callable[[], None]  # Catches up after suspend()
+    close: Callable[[], None]  # Unsubscribes and drops the rendered messages
+    live_messages: Callable[[], int]  # Rendered message controls
+
+
+def build_chat_views(page: ft.Page, updates):
+    # The signed-in part of a session: chat, polls, events, files, search
+    # and the calendar. Built on the first route to /chat; the poll, event,
+    # upload and search controls are only created when first used.
+    hubs = get_hub_registry()
+    polls = get_poll_engine()
+    events = get_event_store()
+    reminders = get_reminder_scheduler()
+    files = get_file_store()
+    search = get_search_index()
+    limiter = get_publish_limiter()
+    sessions = get_session_registry()
+    presence = get_presence_tracker()
+    lazy = {}  # name -> control, for parts built on first use
+    uploads = {}  # picked file name -> its unique name in UPLOAD_DIR, while uploading
+
+    def current_hub():
+        return page.session.get("hub") or config.DEFAULT_HUB
+
+    def publish(message: Message):
+        # Persisted to the hub's log, then delivered to that hub's sessions
+        # only. Returns False, having told the user, while the broker is
+        # unreachable.
+        try:
+            hubs.publish(message)
+        except BrokerUnavailableError:
+            show_snack(UNREACHABLE)
+            return False
+        return True
+
+    def within_limits(hub):
+        # Checked before doing any work for something the user wants to post
+        sessions.touch(page.session_id)
+        if limiter.allow(page.session.get("user"), hub):
+            return True
+        metrics.PUBLISH_REJECTED.inc()
+        show_snack("You're posting too fast. Please wait a moment.")
+        updates.flush()
+        return False
+
+    def join_hub(hub):
+        nonlocal caught_up
+        previous = page.session.get("hub")
+        if previous:
+            hubs.unsubscribe(previous, page.session_id)
+        page.session.set("hub", hub)
+        hubs.subscribe(hub, page.session_id, delivery)
+        set_present(hub)
+        chat_window.clear()
+        chat_window.history = lambda seq, count: hubs.before(hub, seq, count)
+        try:
+            chat_window.extend(hubs.recent(hub, config.CHAT_HISTORY_REPLAY))
+        except (BrokerUnavailableError, TimeoutError):
+            show_snack(UNREACHABLE)  # Live messages still arrive once it is back
+        hub_title.value = f"Hub: {hub}"
+        show_online(hub)
+        # Subscribed before the replay: deliveries it already covered are dropped
+        caught_up = chat_window.last_seq
+
+    def catch_up():
+        # Renders only what the session missed while disconnected or too far
+        # behind, from the hub's replay buffer; a gap older than the buffer
+        # reloads the hub instead.
+        nonlocal caught_up
+        hub = current_hub()
+        hubs.subscribe(hub, page.session_id, delivery)
+        set_present(hub)
+        missed = hubs.since(hub, chat_window.last_seq)
+        if missed is None:
+            metrics.CATCH_UPS.inc("snapshot")
+            join_hub(hub)
+        else:
+            metrics.CATCH_UPS.inc("delta")
+            for message in missed:
+                chat_window.add(message)
+            if missed:
+                # Published after subscribing: these are delivered again
+                caught_up = missed[-1].seq
+        updates.request()
+
+    caught_up = 0  # Deliveries up to this seq were already replayed
+
+    def set_present(hub):
+        # Moves this session's presence to hub, or takes it offline for None
+        nonlocal present
+        user = page.session.get("user")
+        if present == (hub, user):
+            return
+        if present is not None:
+            presence.leave(*present)
+        present = (hub, user) if hub is not None else None
+        if present is not None:
+            presence.join(*present)
+
+    present = None  # (hub, user) this session is counted online in
+
+    def show_online(hub):
+        members = presence.members(hub)
+        online.value = f"{len(members)} online"
+        online.tooltip = "\n".join(members[:50]) + ("\n..." if len(members) > 50 else "")
+
+    def hub_from(field):
+        # The hub typed into field, or None after flagging the field
+        try:
+            hub = normalize_hub(field.value)
+        except InvalidHubNameError as error:
+            field.error_text = str(error)
+            return None
+        field.error_text = None
+        return hub
+
+    def show_snack(text):
+        page.snack_bar = ft.SnackBar(ft.Text(text))
+        page.snack_bar.open = True
+        updates.request()
+
+    # *************** Messages *************
+
+    def send_message_click(e):
+        if new_message.value.strip() and within_limits(current_hub()):
+            msg = Message(
+                user=page.session.get("user"),
+                text=new_message.value.strip(),
+                message_type="chat_message",
+                hub=current_hub(),
+            )
+            if publish(msg):
+                new_message.value = ""
+        updates.request(new_message)
+        updates.flush()
+
+    def apply_poll_results(message: Message):
+        results = render_context.poll_result_texts.get(message.ref)
+        poll = polls.get(message.ref)
+        if results is not None and poll is not None:
+            results.value = format_results(poll.options, message.attachments)
+            updates.request(results)
+
+    def render_message(message: Message):
+        return render(message, render_context)
+
+    def on_message(message: Message):
+        if message.hub != current_hub():
+            return  # Delivered just before the session switched hubs
+        if message.message_type == "poll_results":
+            apply_poll_results(message)
+            return
+        if message.message_type == "login_message":
+            # The tracker has applied the change; re-syncs are not shown
+            show_online(message.hub)
+            updates.request(online)
+            if message.ref == SYNC:
+                return
+        if message.seq and message.seq <= caught_up:
+            return
+        chat_window.add(message)
+        # Timed to the page update that takes the message to the client
+        updates.request(chat, on_sent=lambda: metrics.PUBLISH_TO_RENDER.observe(time.time() - message.sent_at))
+
+    # *************** Files *************
+
+    def share_file(stored):
+        publish(
+            Message(
+                user=page.session.get("user"),
+                text=stored.name,
+                message_type="file",
+                attachments=[stored.name],
+                hub=current_hub(),
+                ref=stored.digest,
+            )
+        )
+
+    def store_file(path, name, remove_source=False):
+        # Streams the file into the shared store in chunks and announces it
+        try:
+            if within_limits(current_hub()):
+                share_file(files.ingest(path, page.session.get("user"), name))
+        except QuotaExceededError:
+            show_snack("Upload failed: your file storage quota is full.")
+        except OSError as error:
+            log.warning("Could not store %s from %s: %s", name, path, error)
+            show_snack(f"Upload of {name} failed.")
+        finally:
+            if remove_source:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def upload_file_click(e: ft.FilePickerResultEvent):
+        picker = e.control
+        if picker.files:
+            web_uploads = []
+            for file in picker.files:
+                if file.path:
+                    store_file(file.path, file.name)  # Desktop: read in place
+                else:
+                    # Stored under a unique name so users uploading files
+                    # with the same name never overwrite each other
+                    uploads[file.name] = f"{uuid.uuid4().hex}-{os.path.basename(file.name)}"
+                    web_uploads.append(
+                        ft.FilePickerUploadFile(file.name, upload_url=page.get_upload_url(uploads[file.name], 600))
+                    )
+            if web_uploads:
+                picker.upload(web_uploads)
+        updates.request()
+
+    def upload_progress(e: ft.FilePickerUploadEvent):
+        # Web: Flet streams the upload into UPLOAD_DIR, then it moves to the store
+        if e.error:
+            uploads.pop(e.file_name, None)
+            show_snack(f"Upload of {e.file_name} failed: {e.error}")
+        elif e.progress is not None and e.progress >= 1.0:
+            upload_name = uploads.pop(e.file_name, None)
+            if upload_name is not None:
+                store_file(os.path.join(config.UPLOAD_DIR, upload_name), e.file_name, remove_source=True)
+
+    def pick_files_click(e):
+        # The picker joins the page overlay on the first upload
+        picker = lazy.get("picker")
+        if picker is None:
+            picker = lazy["picker"] = ft.FilePicker(on_result=upload_file_click, on_upload=upload_progress)
+            page.overlay.append(picker)
+            page.update()
+        picker.pick_files(allow_multiple=True)
+
+    def download_file(digest, file_name):
+        destination = os.path.join(config.DOWNLOAD_DIR, os.path.basename(file_name))
+        try:
+            files.copy_to(digest, destination)
+            show_snack(f"Saved {file_name} to {destination}")
+        except FileNotFoundError:
+            show_snack(f"File {file_name} not found.")
+
+    # *************** Polls *************
+
+    def create_poll_click(e):
+        if poll_question.value.strip() and poll_options.value.strip() and within_limits(current_hub()):
+            options = [opt.strip() for opt in poll_options.value.split(",")]
+            try:
+                # Built first, so options the message cannot carry never create a poll
+                announcement = Message(
+                    user=page.session.get("user"),
+                    text=poll_question.value,
+                    message_type="poll",
+                    attachments=options,
+                    hub=current_hub(),
+                )
+            except ValueError:
+                poll_options.error_text = "Too many options, or an option is too long"
+            else:
+                poll = polls.create(announcement.text, options, announcement.hub)
+                publish(announcement.replace(ref=poll.poll_id))
+                poll_options.error_text = None
+                poll_question.value = ""
+                poll_options.value = ""
+        updates.request(poll_question, poll_options)
+        updates.flush()
+
+    def vote_for_option(poll_id, option):
+        sessions.touch(page.session_id)
+        try:
+            voted = polls.vote(poll_id, page.session.get("user"), option)
+        except (BrokerUnavailableError, TimeoutError):
+            show_snack(UNREACHABLE)
+            return
+        if voted:
+            log.debug("Vote recorded: %s - %s", poll_id, option)
+        else:
+            show_snack("You have already voted in this poll.")
+
+    render_context = RenderContext(vote=vote_for_option, download=download_file)
+
+    def poll_form():
+        nonlocal poll_question, poll_options
+        poll_question = ft.TextField(
+            label="Poll Question",
+            hint_text="Enter your poll question...",
+        )
+        poll_options = ft.TextField(
+            label="Poll Options (comma-separated)",
+            hint_text="e.g., Option1, Option2, Option3",
+        )
+        create_poll_button = ft.ElevatedButton(
+            text="Create Poll",
+            on_click=create_poll_click,
+        )
+        return ft.Column(
+            controls=[
+                ft.Row(controls=[poll_question]),
+                ft.Row(controls=[poll_options]),
+                ft.Row(controls=[create_poll_button]),
+            ],
+            alignment=ft.MainAxisAlignment.CENTER,
+        )
+
+    poll_question = poll_options = None  # Set by poll_form()
+
+    # *************** Events *************
+
+    def add_structured_event(event: Event):
+        # Shared by the event form and the calendar: store, schedule, announce.
+        # Returns False, having told the user, if the event was not stored.
+        try:
+            events.add(event)
+        except BrokerUnavailableError:
+            show_snack(UNREACHABLE)
+            return False
+        reminders.schedule(event)
+        publish(
+            Message(
+                user=event.created_by,
+                text=event.announcement(),
+                message_type="event_message",
+                hub=event.hub,
+                ref=event.event_id,
+            )
+        )
+        return True
+
+    def create_event_click(e):
+        hub = hub_from(event_hub) if event_hub.value.strip() else None
+        if (
+            event_name.value.strip()
+            and event_venue.value.strip()
+            and event_time.value.strip()
+            and hub
+            and within_limits(hub)
+        ):
+            try:
+                starts_at, all_day = parse_event_time(event_time.value)
+            except ValueError:
+                event_time.error_text = "Use the format YYYY-MM-DD HH:MM"
+                updates.request(event_time)
+                updates.flush()
+                return
+            added = add_structured_event(
+                Event.create(
+                    name=event_name.value.strip(),
+                    starts_at=starts_at,
+                    all_day=all_day,
+                    hub=hub,
+                    created_by=page.session.get("user"),
+                    venue=event_venue.value.strip(),
+                    description=event_description.value.strip(),
+                )
+            )
+            if added:
+                # Clear input fields
+                event_time.error_text = None
+                event_name.value = ""
+                event_venue.value = ""
+                event_time.value = ""
+                event_hub.value = ""
+                event_description.value = ""
+        updates.request(event_name, event_venue, event_time, event_hub, event_description)
+        updates.flush()
+
+    def event_form():
+        nonlocal event_name, event_venue, event_time, event_hub, event_description
+        event_name = ft.TextField(label="Event Name", hint_text="Enter the event name...")
+        event_venue = ft.TextField(label="Venue", hint_text="Enter the venue...")
+        event_time = ft.TextField(label="Time", hint_text="YYYY-MM-DD HH:MM")
+        event_hub = ft.TextField(label="Hub Name", hint_text="Enter the hub name...")
+        event_description = ft.TextField(label="Description", hint_text="Enter a short description...")
+        create_event_button = ft.ElevatedButton(
+            text="Create Event",
+            on_click=create_event_click,
+        )
+        return ft.Column(
+            controls=[
+                ft.Row(controls=[event_name]),
+                ft.Row(controls=[event_venue]),
+                ft.Row(controls=[event_time]),
+                ft.Row(controls=[event_hub]),
+                ft.Row(controls=[event_description]),
+                ft.Row(controls=[create_event_button]),
+            ],
+            alignment=ft.MainAxisAlignment.CENTER,
+        )
+
+    event_name = event_venue = event_time = event_hub = event_description = None  # Set by event_form()
+
+    def toggle_form(name, build):
+        # Shows or hides a form below the chat, building it on first use
+        sessions.touch(page.session_id)
+        form = lazy.get(name)
+        if form is None:
+            form = lazy[name] = build()
+            form.visible = False
+            forms.controls.append(form)
+        form.visible = not form.visible
+        updates.request(forms)
+        updates.flush()
+
+    # *************** Calendar *************
+
+    def go_to_calendar(e):
+        page.route = "/calendar"
+        page.update()
+
+    def calendar_view():
+        # Returns the calendar layout and a function that reloads the visible
+        # month. Day cells are built once and patched in place.
+        month_start = date.today().replace(day=1)
+        day_cells = {}  # {date: events ft.Text} for the visible month
+
+        def add_event(e):
+            if event_date.value and event_description.value and within_limits(current_hub()):
+                try:
+                    day = date.fromisoformat(event_date.value.strip())
+                except ValueError:
+                    event_date.error_text = "Use the format YYYY-MM-DD"
+                    updates.request(event_date)
+                    updates.flush()
+                    return
+                added = add_structured_event(
+                    Event.create(
+                        name=event_description.value.strip(),
+                        starts_at=datetime.combine(day, datetime.min.time()),
+                        all_day=True,
+                        hub=current_hub(),
+                        created_by=page.session.get("user"),
+                    )
+                )
+                if added:
+                    event_date.value = ""
+                    event_date.error_text = None
+                    event_description.value = ""
+                    update_day(day)
+            updates.request(event_date, event_description)
+            updates.flush()
+
+        def update_day(day):
+            # Only the affected cell changes, and only if it is on screen
+            cell = day_cells.get(day)
+            if cell is not None:
+                cell.value = "\n".join(event.label() for event in events.on(day))
+                updates.request(cell)
+
+        def show_month(first_day):
+            nonlocal month_start
+            month_start = first_day
+            next_month = (first_day + timedelta(days=32)).replace(day=1)
+            month_events = events.between(first_day, next_month)
+            month_title.value = first_day.strftime("%B %Y")
+            day_cells.clear()
+            for i, cell in enumerate(calendar.controls):
+                day = first_day + timedelta(days=i)
+                cell.visible = day < next_month
+                if cell.visible:
+                    date_text, events_text = cell.content.controls
+                    date_text.value = day.isoformat()
+                    events_text.value = "\n".join(event.label() for event in month_events.get(day, ()))
+                    day_cells[day] = events_text
+            updates.request(month_title, calendar)
+
+        def change_month(step):
+            shifted = month_start + timedelta(days=32 if step > 0 else -1)
+            show_month(shifted.replace(day=1))
+
+        event_date = ft.TextField(label="Event Date (YYYY-MM-DD)", width=200)
+        event_description = ft.TextField(label="Event Description", width=300)
+        add_event_button = ft.ElevatedButton(text="Add Event", on_click=add_event)
+        month_title = ft.Text(weight=ft.FontWeight.BOLD, size=18)
+
+        # Adjusting GridView to use rows and runs_count if columns is not supported
+        calendar = ft.GridView(
+            expand=True,
+            runs_count=7,  # For 7 items in a row (one for each day of the week)
+            spacing=10,
+            controls=[
+                ft.Container(
+                    content=ft.Column(
+                        [
+                            ft.Text(weight=ft.FontWeight.BOLD),
+                            ft.Text(size=12),
+                        ]
+                    ),
+                    border=ft.border.all(1, ft.colors.OUTLINE),
+                    padding=5,
+                    expand=True,
+                )
+                for _ in range(31)  # Longest month; unused days are hidden
+            ],
+        )
+
+        show_month(month_start)
+
+        layout = ft.Column(
+            [
+                ft.Row([event_date, event_description, add_event_button]),
+                ft.Row(
+                    [
+                        ft.IconButton(icon=ft.icons.CHEVRON_LEFT, on_click=lambda e: change_month(-1)),
+                        month_title,
+                        ft.IconButton(icon=ft.icons.CHEVRON_RIGHT, on_click=lambda e: change_month(1)),
+                    ]
+                ),
+                calendar,
+                ft.ElevatedButton("Back to Chat", on_click=lambda e: page.go("/chat")),
+            ],
+            spacing=20,
+        )
+        return layout, lambda: show_month(month_start)
+
+    calendar_page = None
+
+    def get_calendar_page():
+        # Built on first visit; later visits only reload the visible month
+        nonlocal calendar_page
+        if calendar_page is None:
+            calendar_page = calendar_view()
+        else:
+            calendar_page[1]()
+        return calendar_page[0]
+
+    # *************** Search *************
+
+    def run_search(query, results_page=0):
+        # Newest matches first; "More" fetches the next page of the same query
+        sessions.touch(page.session_id)
+        dialog = lazy.get("search")
+        if dialog is None:
+            dialog = lazy["search"] = search_dialog()
+        results, more = dialog.content, dialog.actions[0]
+        matches, has_more = search.search(query, page=results_page)
+        if results_page == 0:
+            results.controls.clear()
+        results.controls.extend(
+            ft.Text(
+                f"[{m.hub}] {datetime.fromtimestamp(m.sent_at):%Y-%m-%d %H:%M} {m.user}: {m.text}",
+                size=13,
+                selectable=True,
+            )
+            for m in matches
+        )
+        if not results.controls:
+            results.controls.append(ft.Text("No matching messages.", italic=True))
+        more.visible = has_more
+        more.data = (query, results_page + 1)
+        dialog.title = ft.Text(f"Search: {query}")
+        dialog.open = True
+        page.dialog = dialog
+        page.update()
+
+    def search_dialog():
+        more = ft.TextButton("More", on_click=lambda e: run_search(*e.control.data))
+        dialog = ft.AlertDialog(
+            content=ft.ListView(spacing=5, height=400, width=500),
+            actions=[more, ft.TextButton("Close", on_click=lambda e: close_search())],
+        )
+        return dialog
+
+    def search_click(e):
+        if search_field.value.strip():
+            run_search(search_field.value.strip())
+
+    def close_search():
+        lazy["search"].open = False
+        page.update()
+
+    # *************** Lifecycle *************
+
+    def suspend():
+        hubs.unsubscribe_all(page.session_id)
+        set_present(None)
+        delivery.clear()
+
+    def close():
+        # The session was closed or evicted and these views are not used
+        # again: stop deliveries and drop the rendered messages now rather
+        # than whenever the last reference to the page goes.
+        suspend()
+        chat_window.clear()
+        chat_window.history = None
+
+    # ************ Chat UI ************
+    chat = ft.ListView(expand=True, spacing=10, auto_scroll=True)
+    # Only the newest CHAT_WINDOW_SIZE messages are live controls; older ones
+    # are paged back in when the user scrolls up.
+    chat_window = ChatWindow(
+        chat, render_message, on_error=lambda error: show_snack(UNREACHABLE), lock=updates.controls_lock
+    )
+    # Messages reach on_message through a bounded per-session queue, which
+    # holds them back while this session's own page updates are lagging
+    delivery = DeliveryQueue(on_message, on_overflow=catch_up, ready=updates.keeping_up)
+
+    hub_title = ft.Text(weight=ft.FontWeight.BOLD, size=16)
+    online = ft.Text(size=12, italic=True)
+
+    def join_hub_click(e):
+        sessions.touch(page.session_id)
+        hub = hub_from(hub_name) if hub_name.value.strip() else None
+        if hub:
+            join_hub(hub)
+            hub_name.value = ""
+        updates.request()
+        updates.flush()
+
+    hub_name = ft.TextField(
+        label="Hub",
+        hint_text="Join another hub...",
+        on_submit=join_hub_click,
+    )
+    search_field = ft.TextField(
+        label="Search",
+        hint_text="words, user:, hub:, type:, after:, before:",
+        on_submit=search_click,
+    )
+    new_message = ft.TextField(
+        hint_text="Write a message...",
+        autofocus=True,
+        shift_enter=True,
+        min_lines=1,
+        max_lines=5,
+        filled=True,
+        expand=True,
+        on_submit=send_message_click,
+    )
+    forms = ft.Column()  # Poll and event forms, once opened
+
+    # Subscribe to the default hub's topic
+    join_hub(config.DEFAULT_HUB)
+
+    layout = ft.Column(
+        [
+            ft.Row(
+                controls=[
+                    hub_title,
+                    online,
+                    hub_name,
+                    ft.ElevatedButton("Join Hub", on_click=join_hub_click),
+                    search_field,
+                    ft.IconButton(icon=ft.icons.SEARCH, tooltip="Search messages", on_click=search_click),
+                ],
+            ),
+            ft.Container(
+                content=chat,
+                border=ft.border.all(1, ft.colors.OUTLINE),
+                border_radius=5,
+                padding=10,
+                expand=True,
+            ),
+            ft.Row(
+                controls=[
+                    ft.IconButton(
+                        icon=ft.icons.FILE_UPLOAD,
+                        tooltip="Upload file",
+                        on_click=pick_files_click,
+                    ),
+                    new_message,
+                    ft.IconButton(
+                        icon=ft.icons.SEND_ROUNDED,
+                        tooltip="Send message",
+                        on_click=send_message_click,
+                    ),
+                    ft.ElevatedButton(
+                        "View Event Calendar",
+                        on_click=go_to_calendar,
+                    ),
+                    ft.TextButton("New Poll", on_click=lambda e: toggle_form("poll", poll_form)),
+                    ft.TextButton("New Event", on_click=lambda e: toggle_form("event", event_form)),
+                ],
+            ),
+            forms,
+        ]
+    )
+    return ChatViews(layout, get_calendar_page, suspend, catch_up, close, lambda: len(chat.controls))
@@ -0,0 +1,109 @@
+import os
+
+# Runtime settings. Each value can be overridden with an environment variable
+# so deployments don't need code changes.
+
+
+def _env_str(name, default):
+    return os.environ.get(name, default)
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# Users database
+DB_BACKEND = _env_str("CRAMJAM_DB_BACKEND", "mongo")  # "mongo" or "memory"
+MONGO_URI = _env_str("CRAMJAM_MONGO_URI", "mongodb://localhost:27017")  # credentials belong in the environment
+MONGO_DB_NAME = _env_str("CRAMJAM_MONGO_DB", "cram_jam_db")
+MONGO_MAX_POOL_SIZE = _env_int("CRAMJAM_MONGO_MAX_POOL_SIZE", 50)
+MONGO_MIN_POOL_SIZE = _env_int("CRAMJAM_MONGO_MIN_POOL_SIZE", 0)
+DB_TIMEOUT_MS = _env_int("CRAMJAM_DB_TIMEOUT_MS", 5000)  # per auth call, queueing included
+AUTH_MAX_WORKERS = _env_int("CRAMJAM_AUTH_MAX_WORKERS", 8)
+USER_NAME_MAX_LENGTH = _env_int("CRAMJAM_USER_NAME_MAX_LENGTH", 64)  # characters, for new accounts
+
+# Password hashing
+KDF_ITERATIONS = _env_int("CRAMJAM_KDF_ITERATIONS", 600_000)  # PBKDF2-SHA256
+KDF_WORKERS = _env_int("CRAMJAM_KDF_WORKERS", os.cpu_count() or 1)
+VERIFY_CACHE_SIZE = _env_int("CRAMJAM_VERIFY_CACHE_SIZE", 10_000)
+VERIFY_CACHE_TTL = _env_int("CRAMJAM_VERIFY_CACHE_TTL", 300)  # seconds
+IMPORT_BATCH_SIZE = _env_int("CRAMJAM_IMPORT_BATCH_SIZE", 1000)  # users per insert_many
+
+# Chat history
+CHAT_WINDOW_SIZE = _env_int("CRAMJAM_CHAT_WINDOW_SIZE", 200)  # live controls per session
+CHAT_PAGE_SIZE = _env_int("CRAMJAM_CHAT_PAGE_SIZE", 50)  # messages paged in per scroll
+CHAT_STORED_MESSAGES = _env_int("CRAMJAM_CHAT_STORED_MESSAGES", 2000)
+
+# UI updates
+UPDATE_INTERVAL_MS = _env_int("CRAMJAM_UPDATE_INTERVAL_MS", 33)  # max one flush per frame
+UPDATE_WORKERS = _env_int("CRAMJAM_UPDATE_WORKERS", 16)  # threads running page updates and deliveries
+# Deliveries to a session pause while its oldest unsent page update has
+# waited longer than this, e.g. behind a slow connection
+SESSION_MAX_LAG_MS = _env_int("CRAMJAM_SESSION_MAX_LAG_MS", 1000)
+UPDATE_RETRY_MAX_MS = _env_int("CRAMJAM_UPDATE_RETRY_MAX_MS", 5000)  # backoff cap for a failing page update
+
+# Message log
+LOG_DIR = _env_str("CRAMJAM_LOG_DIR", "message_log")
+LOG_SEGMENT_BYTES = _env_int("CRAMJAM_LOG_SEGMENT_BYTES", 8 * 1024 * 1024)
+LOG_RETAIN_SEGMENTS = _env_int("CRAMJAM_LOG_RETAIN_SEGMENTS", 64)  # older segments are compacted away
+LOG_FSYNC = _env_str("CRAMJAM_LOG_FSYNC", "0") == "1"
+CHAT_HISTORY_REPLAY = _env_int("CRAMJAM_CHAT_HISTORY_REPLAY", 100)  # messages shown on join
+# Newest messages kept in memory per hub, for joins and reconnects; a
+# session that missed more than this gets a fresh snapshot instead
+REPLAY_BUFFER_SIZE = _env_int("CRAMJAM_REPLAY_BUFFER_SIZE", 1000)
+
+# Hubs
+DEFAULT_HUB = _env_str("CRAMJAM_DEFAULT_HUB", "general")
+HUB_NAME_MAX_LENGTH = _env_int("CRAMJAM_HUB_NAME_MAX_LENGTH", 32)  # characters; each hub is a directory
+OPEN_HUB_LOGS = _env_int("CRAMJAM_OPEN_HUB_LOGS", 256)  # least recently used hub logs are closed past this
+
+# Polls
+POLL_PUSH_INTERVAL_MS = _env_int("CRAMJAM_POLL_PUSH_INTERVAL_MS", 250)  # result broadcast throttle
+
+# Presence
+PRESENCE_PUSH_INTERVAL_MS = _env_int("CRAMJAM_PRESENCE_PUSH_INTERVAL_MS", 1000)  # join/leave batching
+
+# Events
+REMINDER_LEAD_MINUTES = _env_int("CRAMJAM_REMINDER_LEAD_MINUTES", 15)
+
+# Rendering
+USER_STYLE_CACHE_SIZE = _env_int("CRAMJAM_USER_STYLE_CACHE_SIZE", 4096)  # users with memoized styling
+
+# File sharing
+FILE_STORE_DIR = _env_str("CRAMJAM_FILE_STORE_DIR", "shared_files")
+UPLOAD_DIR = _env_str("CRAMJAM_UPLOAD_DIR", "uploads")  # Flet web uploads land here first
+DOWNLOAD_DIR = _env_str("CRAMJAM_DOWNLOAD_DIR", "downloads")
+FILE_CHUNK_BYTES = _env_int("CRAMJAM_FILE_CHUNK_BYTES", 1024 * 1024)
+USER_QUOTA_BYTES = _env_int("CRAMJAM_USER_QUOTA_BYTES", 1024 * 1024 * 1024)
+
+# Search
+SEARCH_MEMORY_BYTES = _env_int("CRAMJAM_SEARCH_MEMORY_BYTES", 64 * 1024 * 1024)
+SEARCH_PAGE_SIZE = _env_int("CRAMJAM_SEARCH_PAGE_SIZE", 20)
+
+# Publish limits (messages per second, and the burst allowed above that)
+USER_PUBLISH_RATE = _env_int("CRAMJAM_USER_PUBLISH_RATE", 2)
+USER_PUBLISH_BURST = _env_int("CRAMJAM_USER_PUBLISH_BURST", 10)
+HUB_PUBLISH_RATE = _env_int("CRAMJAM_HUB_PUBLISH_RATE", 50)
+HUB_PUBLISH_BURST = _env_int("CRAMJAM_HUB_PUBLISH_BURST", 200)
+RATE_LIMIT_KEYS = _env_int("CRAMJAM_RATE_LIMIT_KEYS", 100000)
+# Messages buffered per subscriber before it is resynced from the hub log
+DELIVERY_QUEUE_SIZE = _env_int("CRAMJAM_DELIVERY_QUEUE_SIZE", 500)
+
+# Sessions: released after this long without user activity, or, least
+# recently active first, while their estimated memory is over the cap
+SESSION_IDLE_SECONDS = _env_int("CRAMJAM_SESSION_IDLE_SECONDS", 30 * 60)
+SESSION_MEMORY_BYTES = _env_int("CRAMJAM_SESSION_MEMORY_BYTES", 512 * 1024 * 1024)
+SESSION_SWEEP_SECONDS = _env_int("CRAMJAM_SESSION_SWEEP_SECONDS", 30)
+
+# Pubsub and shared state: "local" keeps everything in this process; "broker"
+# shares hubs, polls and events between workers through broker.py
+PUBSUB_BACKEND = _env_str("CRAMJAM_PUBSUB_BACKEND", "local")
+BROKER_SOCKET = _env_str("CRAMJAM_BROKER_SOCKET", "cramjam-broker.sock")
+BROKER_TIMEOUT_MS = _env_int("CRAMJAM_BROKER_TIMEOUT_MS", 5000)
+BROKER_RECONNECT_MAX_MS = _env_int("CRAMJAM_BROKER_RECONNECT_MAX_MS", 5000)  # backoff cap after a lost connection
+
+# Diagnostics
+LOGGING_LEVEL = _env_str("CRAMJAM_LOGGING_LEVEL", "INFO")
+METRICS_PORT = _env_int("CRAMJAM_METRICS_PORT", 9464)  # 0 disables the /metrics endpoint
+METRICS_DUMP_SECONDS = _env_int("CRAMJAM_METRICS_DUMP_SECONDS", 0)  # 0 disables the periodic log dump
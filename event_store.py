@@ -0,0 +1,109 @@
+import threading
+import uuid
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import NamedTuple
+
+import config
+
+_TIME_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d")
+
+
+def parse_event_time(text):
+    # Returns (datetime, all_day); raises ValueError for anything else
+    text = text.strip()
+    for time_format in _TIME_FORMATS:
+        try:
+            return datetime.strptime(text, time_format), time_format == "%Y-%m-%d"
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised event time: {text!r}")
+
+
+class Event(NamedTuple):
+    event_id: str
+    name: str
+    starts_at: datetime
+    all_day: bool
+    hub: str
+    created_by: str
+    venue: str = ""
+    description: str = ""
+
+    @classmethod
+    def create(cls, name, starts_at, all_day, hub, created_by, venue="", description=""):
+        return cls(uuid.uuid4().hex, name, starts_at, all_day, hub, created_by, venue, description)
+
+    @property
+    def day(self):
+        return self.starts_at.date()
+
+    def label(self):
+        # One line in a calendar cell
+        return self.name if self.all_day else f"{self.starts_at:%H:%M} {self.name}"
+
+    def announcement(self):
+        when = f"{self.day:%Y-%m-%d}" if self.all_day else f"{self.starts_at:%Y-%m-%d %H:%M}"
+        return (
+            f"📅 {self.created_by} just added an event:\n"
+            f"**{self.name}**\n"
+            f"Venue: {self.venue}\n"
+            f"Time: {when}\n"
+            f"Hub: {self.hub}\n"
+            f"Description: {self.description}"
+        )
+
+
+class EventStore:
+    # Structured events bucketed by calendar date, with the dates kept sorted so a month
+    # or week is a bisect plus a slice. Reads never create empty buckets.
+    def __init__(self):
+        self._dates = []  # sorted datetime.date keys
+        self._by_date = {}  # date -> [Event, ...] in start order
+        self._by_id = {}  # event_id -> Event
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        day = event.day
+        with self._lock:
+            events = self._by_date.get(day)
+            if events is None:
+                events = self._by_date[day] = []
+                insort(self._dates, day)
+            insort(events, event, key=lambda item: item.starts_at)
+            self._by_id[event.event_id] = event
+
+    def get(self, event_id):
+        return self._by_id.get(event_id)
+
+    def all(self):
+        with self._lock:
+            return list(self._by_id.values())
+
+    def on(self, day):
+        with self._lock:
+            return tuple(self._by_date.get(day, ()))
+
+    def between(self, start, end):
+        # {date: (event, ...)} for start <= date < end, only for dates with events
+        with self._lock:
+            first = bisect_left(self._dates, start)
+            last = bisect_left(self._dates, end)
+            return {day: tuple(self._by_date[day]) for day in self._dates[first:last]}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_event_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if config.PUBSUB_BACKEND == "broker":
+                    from broker import RemoteEventStore as store_class  # broker imports this module
+                else:
+                    store_class = EventStore
+                _store = store_class()
+    return _store
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import NamedTuple
+
+import config
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class StoredFile(NamedTuple):
+    digest: str  # sha256 of the content, also its storage key
+    name: str
+    size: int
+
+
+class FileStore:
+    # Content-addressed blobs: every file is stored once under
+    # objects/<first two hex digits>/<sha256>, however many times it is
+    # shared. Files are copied in chunk by chunk through uploads/<id>.part
+    # and hashed on the way, so they are never read whole. Uploads are not
+    # resumable: a dropped web upload starts over, and part files left by an
+    # interrupted ingest are removed at startup. Each user is charged once
+    # per distinct file against their quota.
+    def __init__(self, root=None, chunk_size=None, quota_bytes=None):
+        self.root = root or config.FILE_STORE_DIR
+        self.chunk_size = chunk_size or config.FILE_CHUNK_BYTES
+        self.quota_bytes = quota_bytes or config.USER_QUOTA_BYTES
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "uploads"), exist_ok=True)
+        for name in os.listdir(os.path.join(self.root, "uploads")):
+            if name.endswith(".part"):
+                os.remove(os.path.join(self.root, "uploads", name))
+        self._index_path = os.path.join(self.root, "index.json")
+        try:
+            with open(self._index_path) as index:
+                self._owned = json.load(index)  # {user: {digest: size}}
+        except FileNotFoundError:
+            self._owned = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def usage(self, user):
+        return sum(self._owned.get(user, {}).values())
+
+    def _check_quota(self, user, size):
+        if self.usage(user) + size > self.quota_bytes:
+            raise QuotaExceededError(f"{user} would exceed the {self.quota_bytes} byte quota")
+
+    def ingest(self, path, user, name=None):
+        # Streams a local file into the store and returns its StoredFile
+        self._check_quota(user, os.path.getsize(path))
+        part_path = os.path.join(self.root, "uploads", f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as source, open(part_path, "wb") as part:
+                for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                    digest.update(chunk)
+                    part.write(chunk)
+            stored = StoredFile(digest.hexdigest(), os.path.basename(name or path), os.path.getsize(part_path))
+            self._check_quota(user, stored.size)  # The source may have grown meanwhile
+            target = self.object_path(stored.digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.exists(target):
+                os.remove(part_path)  # Identical content is already stored
+            else:
+                os.replace(part_path, target)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._charge(user, stored)
+        return stored
+
+    def _charge(self, user, stored):
+        with self._lock:
+            owned = self._owned.setdefault(user, {})
+            if stored.digest in owned:
+                return
+            owned[stored.digest] = stored.size
+            temp_path = self._index_path + ".tmp"
+            with open(temp_path, "w") as index:
+                json.dump(self._owned, index)
+            os.replace(temp_path, self._index_path)
+
+    # Downloads
+
+    def copy_to(self, digest, destination):
+        # Kernel-side copy with sendfile where supported, else chunked.
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        with open(self.object_path(digest), "rb") as source, open(destination, "wb") as target:
+            size = os.fstat(source.fileno()).st_size
+            try:
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(target.fileno(), source.fileno(), offset, min(size - offset, 1 << 30))
+                    if sent == 0:
+                        break
+                    offset += sent
+            except (AttributeError, OSError):
+                source.seek(0)
+                target.seek(0)
+                target.truncate()
+                shutil.copyfileobj(source, target, self.chunk_size)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_file_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = FileStore()
+    return _store
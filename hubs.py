@@ -0,0 +1,340 @@
+import itertools
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import quote, unquote
+
+import config
+import metrics
+from message_log import LogClosedError, MessageLog
+from update_scheduler import schedule_flush
+
+log = logging.getLogger(__name__)
+
+
+_HUB_NAME = re.compile(r"[a-z0-9 _-]+")
+
+
+class InvalidHubNameError(ValueError):
+    pass
+
+
+def normalize_hub(name):
+    # Hub names come straight from text fields and each one becomes a log
+    # directory, so they are kept short and to a safe set of characters.
+    name = " ".join((name or "").split()).lower()
+    if not name:
+        return config.DEFAULT_HUB
+    if len(name) > config.HUB_NAME_MAX_LENGTH or not _HUB_NAME.fullmatch(name):
+        raise InvalidHubNameError(
+            f"Hub names are up to {config.HUB_NAME_MAX_LENGTH} letters, digits, spaces, - or _"
+        )
+    return name
+
+
+class DeliveryQueue:
+    # Bounded buffer between publish() and one subscriber's handler, so a
+    # publisher never waits on a slow session. Messages are handed over in
+    # order on the update workers, one batch at a time per queue. Pending
+    # poll results for the same poll collapse into the newest one.
+    # Backpressure is per subscriber: while ready() says the session's own
+    # page updates are backed up, hand-over pauses and messages accumulate.
+    # A subscriber that falls max_pending messages behind has its queue
+    # dropped and on_overflow() is called instead, once it is ready again,
+    # e.g. to catch it up from the hub's replay buffer.
+    def __init__(self, handler, on_overflow=None, max_pending=None, ready=None, retry_ms=None):
+        self.handler = handler
+        self.on_overflow = on_overflow
+        self.max_pending = max_pending or config.DELIVERY_QUEUE_SIZE
+        self.ready = ready
+        self.retry = (retry_ms or config.UPDATE_INTERVAL_MS) / 1000
+        self.dropped = 0
+        self._pending = OrderedDict()
+        self._keys = itertools.count()
+        self._overflowed = False
+        self._scheduled = False  # A hand-over is scheduled or running
+        self._lock = threading.Lock()
+
+    def __call__(self, message):
+        with self._lock:
+            if self._overflowed:
+                self.dropped += 1
+                metrics.DELIVERY_DROPPED.inc()
+                return
+            if message.message_type == "poll_results":
+                key = ("poll_results", message.ref)
+            else:
+                key = next(self._keys)
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                self.dropped += len(self._pending) + 1
+                metrics.DELIVERY_DROPPED.inc(amount=len(self._pending) + 1)
+                self._pending.clear()
+                self._overflowed = True
+            else:
+                self._pending[key] = message
+            if self._scheduled:
+                return
+            self._scheduled = True
+        schedule_flush(self, 0)
+
+    def gap(self):
+        # Messages may have been missed, e.g. while the broker was
+        # unreachable: on_overflow() catches the subscriber up instead
+        with self._lock:
+            self._pending.clear()
+            self._overflowed = True
+            if self._scheduled:
+                return
+            self._scheduled = True
+        schedule_flush(self, 0)
+
+    def clear(self):
+        # Drops whatever is pending, e.g. when the subscriber goes away
+        with self._lock:
+            self._pending.clear()
+            self._overflowed = False
+
+    def flush(self):
+        with self._lock:
+            if not self._pending and not self._overflowed:
+                self._scheduled = False
+                return
+        if self.ready is not None and not self.ready():
+            schedule_flush(self, self.retry)
+            return
+        with self._lock:
+            messages = list(self._pending.values())
+            overflowed = self._overflowed
+            self._pending.clear()
+            self._overflowed = False
+        try:
+            if overflowed:
+                if self.on_overflow is not None:
+                    self.on_overflow()
+            else:
+                for message in messages:
+                    try:
+                        self.handler(message)
+                    except Exception:
+                        log.exception("Delivery to a %s subscriber failed", message.hub)
+        finally:
+            # Anything that arrived meanwhile goes in the next batch
+            schedule_flush(self, 0)
+
+
+class ReplayBuffer:
+    # The newest persisted messages of one hub in seq order, so sessions
+    # that join or reconnect are served from memory. The first session to
+    # need it loads it from the hub's log; sessions arriving meanwhile wait
+    # for that one read instead of each reading the log themselves.
+    def __init__(self, size=None):
+        self.messages = deque(maxlen=size or config.REPLAY_BUFFER_SIZE)
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def add(self, message):
+        with self._lock:
+            self._insert(message)
+
+    def _insert(self, message):
+        messages = self.messages
+        if not messages or message.seq > messages[-1].seq:
+            messages.append(message)
+            return
+        # Concurrent publishers can deliver slightly out of order
+        index = len(messages)
+        while index and messages[index - 1].seq > message.seq:
+            index -= 1
+        if index and messages[index - 1].seq == message.seq:
+            return
+        if len(messages) == messages.maxlen:
+            if index == 0:
+                return  # Older than everything kept
+            messages.popleft()
+            index -= 1
+        messages.insert(index, message)
+
+    def load(self, log):
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            # Read without holding _lock so deliveries keep coming in
+            stored = log.tail(self.messages.maxlen)
+            with self._lock:
+                for message in stored:
+                    self._insert(message)
+                self.loaded = True
+
+    def tail(self, count):
+        with self._lock:
+            return list(itertools.islice(self.messages, max(len(self.messages) - count, 0), None))
+
+    def since(self, seq):
+        # Messages after seq, or None when the buffer does not reach back
+        # that far and the caller needs a snapshot instead
+        with self._lock:
+            if not self.messages:
+                return [] if self.loaded else None
+            if self.messages[0].seq > seq + 1:
+                return None
+            missed = []
+            for message in reversed(self.messages):
+                if message.seq <= seq:
+                    break
+                missed.append(message)
+        missed.reverse()
+        return missed
+
+
+class HubRegistry:
+    # Hubs are the pubsub topics: a message published to a hub is appended to
+    # that hub's log and delivered only to the sessions subscribed to it, so
+    # fan-out scales with the hub's size rather than the number of sessions.
+    # At most max_open_logs hub logs are open at once; the least recently
+    # used one is closed to make room, so every hub name ever typed does not
+    # keep its file descriptors for the life of the process.
+    def __init__(self, log_dir=None, max_open_logs=None):
+        self.log_dir = log_dir or config.LOG_DIR
+        self.max_open_logs = max_open_logs or config.OPEN_HUB_LOGS
+        self._subscribers = {}  # hub -> {session_id: handler}
+        self._logs = OrderedDict()  # hub -> MessageLog, least recently used first
+        self._replay = {}  # hub -> ReplayBuffer, for hubs sessions have read here
+        self._listeners = []  # Called with every persisted message, e.g. the search index
+        self._transient_listeners = []  # Called with every other message, e.g. presence
+        self._lock = threading.Lock()
+
+    def subscribe(self, hub, session_id, handler):
+        with self._lock:
+            self._subscribers.setdefault(hub, {})[session_id] = handler
+
+    def unsubscribe(self, hub, session_id):
+        with self._lock:
+            handlers = self._subscribers.get(hub)
+            if handlers is not None:
+                handlers.pop(session_id, None)
+                if not handlers:
+                    del self._subscribers[hub]
+
+    def unsubscribe_all(self, session_id):
+        with self._lock:
+            hubs = [hub for hub, handlers in self._subscribers.items() if session_id in handlers]
+        for hub in hubs:
+            self.unsubscribe(hub, session_id)
+
+    def subscriber_count(self, hub):
+        return len(self._subscribers.get(hub, ()))
+
+    def subscriber_counts(self):
+        with self._lock:
+            return {hub: len(handlers) for hub, handlers in self._subscribers.items()}
+
+    def add_listener(self, listener, transient=False):
+        (self._transient_listeners if transient else self._listeners).append(listener)
+
+    def known_hubs(self):
+        # Every hub with history on disk, opened or not
+        try:
+            names = os.listdir(self.log_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(unquote(name[4:]) for name in names if name.startswith("hub-"))
+
+    def history(self, hub):
+        # The hub's log. It may be closed by the LRU once the caller lets go
+        # of the registry, so operations on it go through with_log().
+        with self._lock:
+            log = self._logs.get(hub)
+            if log is not None:
+                self._logs.move_to_end(hub)
+                return log
+            # Prefixed and quoted so any hub name is a safe directory
+            directory = os.path.join(self.log_dir, "hub-" + quote(hub, safe=""))
+            log = self._logs[hub] = MessageLog(directory)
+            while len(self._logs) > self.max_open_logs:
+                closed_hub, closed_log = self._logs.popitem(last=False)
+                closed_log.close()
+                if closed_hub not in self._subscribers:
+                    self._replay.pop(closed_hub, None)
+        return log
+
+    def with_log(self, hub, operation):
+        # operation(log) on the hub's log, reopened once if it was closed
+        # between the lookup and the call
+        try:
+            return operation(self.history(hub))
+        except LogClosedError:
+            return operation(self.history(hub))
+
+    def before(self, hub, seq, count):
+        return self.with_log(hub, lambda log: log.before(seq, count))
+
+    def recent(self, hub, count):
+        # The newest count messages of a hub, from its replay buffer
+        buffer = self._replay_buffer(hub)
+        if count > buffer.messages.maxlen:
+            return self.with_log(hub, lambda log: log.tail(count))
+        self.with_log(hub, buffer.load)
+        return buffer.tail(count)
+
+    def since(self, hub, seq):
+        # What a session that last saw seq has missed, or None when that is
+        # older than the replay buffer
+        return self._replay_buffer(hub).since(seq)
+
+    def _replay_buffer(self, hub):
+        buffer = self._replay.get(hub)
+        if buffer is None:
+            with self._lock:
+                buffer = self._replay.setdefault(hub, ReplayBuffer())
+        return buffer
+
+    def publish(self, message, persist=True):
+        # Persist first so the message carries its sequence number. Transient
+        # updates (e.g. poll results) skip the log.
+        metrics.PUBLISHED.inc(message.message_type)
+        if persist:
+            message = self.with_log(message.hub, lambda log: log.append(message))
+        self.deliver(message, persist)
+        return message
+
+    def deliver(self, message, persisted=True):
+        # Hands a published message to the listeners and local subscribers
+        if persisted:
+            buffer = self._replay.get(message.hub)
+            if buffer is not None:
+                buffer.add(message)
+        for listener in self._listeners if persisted else self._transient_listeners:
+            try:
+                listener(message)
+            except Exception:
+                log.exception("Listener for %s failed", message.hub)
+        with self._lock:
+            handlers = list(self._subscribers.get(message.hub, {}).values())
+        for handler in handlers:
+            try:
+                handler(message)
+            except Exception:
+                log.exception("Delivery to a %s subscriber failed", message.hub)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_hub_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                if config.PUBSUB_BACKEND == "broker":
+                    from broker import RemoteHubRegistry as registry_class  # broker imports this module
+                else:
+                    registry_class = HubRegistry
+                _registry = registry_class()
+                metrics.HUB_SUBSCRIBERS.function = _registry.subscriber_counts
+    return _registry
@@ -0,0 +1,68 @@
+# Bulk account provisioning from a registrar CSV export:
+#
+#   python import_users.py students.csv [--user-column user]
+#                          [--password-column password] [--batch-size 1000]
+#                          [--report problems.csv]
+#
+# The file is streamed, so its size does not matter. Rows that cannot be
+# imported (blank fields, names longer than signup allows, existing users)
+# are listed in the report, or on stderr without one, and the rest of the
+# file is still imported. Passwords are hashed at the full
+# CRAMJAM_KDF_ITERATIONS cost, so a large file takes a while; raise
+# CRAMJAM_KDF_WORKERS on a machine with more cores to spread the hashing.
+
+import argparse
+import csv
+import sys
+import time
+
+from users_db import get_users_db
+
+
+def read_rows(path, user_column, password_column):
+    # Yields (row number, user, password); row 1 is the header
+    with open(path, newline="", encoding="utf-8-sig") as source:
+        reader = csv.DictReader(source)
+        missing = {user_column, password_column} - set(reader.fieldnames or ())
+        if missing:
+            raise SystemExit(f"{path} has no column {', '.join(sorted(missing))}")
+        for row_number, row in enumerate(reader, start=2):
+            yield row_number, (row[user_column] or "").strip(), row[password_column] or ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import CramJam accounts from a CSV file")
+    parser.add_argument("csv_file")
+    parser.add_argument("--user-column", default="user")
+    parser.add_argument("--password-column", default="password")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--report", help="write rejected rows to this CSV file instead of stderr")
+    args = parser.parse_args()
+
+    report = open(args.report, "w", newline="", encoding="utf-8") if args.report else sys.stderr
+    writer = csv.writer(report)
+    writer.writerow(["row", "user", "problem"])
+    problems = 0
+
+    def on_problem(row_number, user, reason):
+        nonlocal problems
+        problems += 1
+        writer.writerow([row_number, user, reason])
+
+    started = time.perf_counter()
+    try:
+        added = get_users_db().import_users(
+            read_rows(args.csv_file, args.user_column, args.password_column),
+            on_problem,
+            batch_size=args.batch_size,
+        )
+    finally:
+        if args.report:
+            report.close()
+    elapsed = time.perf_counter() - started
+    print(f"Added {added} users, {problems} rows rejected, in {elapsed:.1f}s ({added / max(elapsed, 1e-9):.0f} users/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
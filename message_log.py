@@ -0,0 +1,199 @@
+import os
+import struct
+import threading
+from array import array
+
+import config
+from chat_message import SEQ_OFFSET, Message
+
+# Record layout: payload length, sequence number, payload.
+_HEADER = struct.Struct("<IQ")
+_SEGMENT_SUFFIX = ".log"
+
+
+class LogClosedError(Exception):
+    pass
+
+
+class _Segment:
+    # One file of consecutive records starting at base_seq. The offset of
+    # every record is kept in memory so any range is a single pread.
+    # Readers hold a reference while they pread, and a retired segment's
+    # descriptor is only closed once the last of them is done, so a reader
+    # can never pread a reused descriptor number that now belongs to
+    # another file. refs and retired are guarded by the log's lock.
+    def __init__(self, path, base_seq):
+        self.path = path
+        self.base_seq = base_seq
+        self.offsets = array("Q")
+        self.size = 0
+        self.refs = 0
+        self.retired = False
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._recover()
+
+    def _recover(self):
+        # Index existing records and drop a torn write at the end, if any.
+        data = os.pread(self.fd, os.fstat(self.fd).st_size, 0)
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, _ = _HEADER.unpack_from(data, offset)
+            if offset + _HEADER.size + length > len(data):
+                break
+            self.offsets.append(offset)
+            offset += _HEADER.size + length
+        if offset != len(data):
+            os.ftruncate(self.fd, offset)
+        self.size = offset
+
+    @property
+    def next_seq(self):
+        return self.base_seq + len(self.offsets)
+
+    def append(self, seq, payload, fsync):
+        record = _HEADER.pack(len(payload), seq) + payload
+        os.pwrite(self.fd, record, self.size)
+        if fsync:
+            os.fsync(self.fd)
+        self.offsets.append(self.size)
+        self.size += len(record)
+
+    def read(self, start_seq, end_seq):
+        # Records with start_seq <= seq < end_seq, clamped to this segment.
+        first = max(start_seq - self.base_seq, 0)
+        last = min(end_seq - self.base_seq, len(self.offsets))
+        if first >= last:
+            return []
+        begin = self.offsets[first]
+        stop = self.offsets[last] if last < len(self.offsets) else self.size
+        data = os.pread(self.fd, stop - begin, begin)
+        records = []
+        offset = 0
+        while offset < len(data):
+            length, seq = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            records.append(Message.decode(data[start:start + length]))
+            offset = start + length
+        return records
+
+    def release(self):
+        # Drops a reader's reference, or the log's own once retired
+        self.refs -= 1
+        if self.retired and self.refs == 0:
+            os.close(self.fd)
+
+    def retire(self):
+        self.retired = True
+        if self.refs == 0:
+            os.close(self.fd)
+
+
+class MessageLog:
+    # Durable, append-only message history. Sequence numbers start at 1 and
+    # increase by one per message. Segments roll over at segment_bytes, and
+    # only the newest retain_segments are kept on disk.
+    def __init__(self, directory=None, segment_bytes=None, retain_segments=None, fsync=None):
+        self.directory = directory or config.LOG_DIR
+        self.segment_bytes = segment_bytes or config.LOG_SEGMENT_BYTES
+        self.retain_segments = retain_segments or config.LOG_RETAIN_SEGMENTS
+        self.fsync = config.LOG_FSYNC if fsync is None else fsync
+        self._lock = threading.Lock()
+        self.closed = False
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments = [
+            _Segment(os.path.join(self.directory, name), int(name[: -len(_SEGMENT_SUFFIX)]))
+            for name in sorted(os.listdir(self.directory))
+            if name.endswith(_SEGMENT_SUFFIX)
+        ]
+        if not self.segments:
+            self._roll(1)
+
+    @property
+    def last_seq(self):
+        self._check_open()
+        return self.segments[-1].next_seq - 1
+
+    @property
+    def first_seq(self):
+        self._check_open()
+        return self.segments[0].base_seq
+
+    def _check_open(self):
+        if self.closed:
+            raise LogClosedError(f"{self.directory} is closed")
+
+    def append(self, message):
+        # Returns the message stamped with its sequence number. Encoding
+        # happens outside the lock; only the seq field is patched inside it.
+        payload = bytearray(message.encode())
+        with self._lock:
+            self._check_open()
+            active = self.segments[-1]
+            if active.size >= self.segment_bytes:
+                active = self._roll(active.next_seq)
+            seq = active.next_seq
+            struct.pack_into("<Q", payload, SEQ_OFFSET, seq)
+            active.append(seq, payload, self.fsync)
+        return message.replace(seq=seq)
+
+    def read_range(self, start_seq, end_seq):
+        # Messages with start_seq <= seq < end_seq that are still retained.
+        # Reads run outside the lock; the references keep compaction from
+        # closing the segments underneath them.
+        with self._lock:
+            self._check_open()
+            segments = [
+                segment
+                for segment in self.segments
+                if segment.next_seq > start_seq and segment.base_seq < end_seq
+            ]
+            for segment in segments:
+                segment.refs += 1
+        messages = []
+        try:
+            for segment in segments:
+                messages.extend(segment.read(start_seq, end_seq))
+        finally:
+            with self._lock:
+                for segment in segments:
+                    segment.release()
+        return messages
+
+    def tail(self, count):
+        end = self.last_seq + 1
+        return self.read_range(max(end - count, 1), end)
+
+    def before(self, seq, count):
+        return self.read_range(max(seq - count, 1), seq)
+
+    def compact(self):
+        # Drop whole segments beyond the retention limit. Their files are
+        # unlinked now; readers still on them keep the open descriptor.
+        with self._lock:
+            if self.closed:
+                return
+            expired = self.segments[: -self.retain_segments]
+            del self.segments[: -self.retain_segments]
+            for segment in expired:
+                segment.retire()
+        for segment in expired:
+            os.remove(segment.path)
+
+    def _roll(self, base_seq):
+        segment = _Segment(
+            os.path.join(self.directory, f"{base_seq:020d}{_SEGMENT_SUFFIX}"), base_seq
+        )
+        self.segments.append(segment)
+        if len(self.segments) > self.retain_segments:
+            threading.Thread(target=self.compact, name="log-compact", daemon=True).start()
+        return segment
+
+    def close(self):
+        # Later calls raise LogClosedError; reads in progress finish first
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            for segment in self.segments:
+                segment.retire()
+
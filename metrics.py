@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+log = logging.getLogger(__name__)
+
+# Process-wide counters, gauges and histograms, exported in the Prometheus
+# text format from a local HTTP endpoint and/or logged periodically. Each
+# update is one short lock and a dict or list increment, cheap enough for
+# every message and page update.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+METRICS = []
+
+
+def _escape(value):
+    # Label values may hold any text; the text format needs backslash,
+    # double quote and newline escaped
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+
+
+class Gauge(Counter):
+    # Either set directly or read from a function when exported; the
+    # function returns a number or {label values: number}.
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def lines(self):
+        if self.function is None:
+            yield from super().lines()
+            return
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.bounds = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.bounds) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def lines(self):
+        with self._lock:
+            series = [(label_values, list(values)) for label_values, values in self._series.items()]
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.bounds + ("+Inf",), values):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, [("le", bound)])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {values[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        try:
+            lines.extend(metric.lines())
+        except Exception:
+            log.exception("Could not collect %s", metric.name)
+    return "\n".join(lines) + "\n"
+
+
+# The app's instruments
+
+ACTIVE_SESSIONS = Gauge("cramjam_active_sessions", "Open Flet sessions")
+SESSION_MEMORY = Gauge("cramjam_session_memory_bytes", "Estimated memory held by sessions not evicted")
+SESSIONS_EVICTED = Counter("cramjam_sessions_evicted_total", "Sessions released", labels=("reason",))
+CATCH_UPS = Counter(
+    "cramjam_catch_ups_total", "Reconnected or resynced sessions, by delta or snapshot", labels=("kind",)
+)
+HUB_SUBSCRIBERS = Gauge("cramjam_hub_subscribers", "Subscribed sessions per hub", labels=("hub",))
+HUB_ONLINE = Gauge("cramjam_hub_online_users", "Signed-in users per hub", labels=("hub",))
+PUBLISHED = Counter("cramjam_published_total", "Messages published", labels=("type",))
+PUBLISH_REJECTED = Counter("cramjam_publish_rejected_total", "Posts refused by the rate limits")
+DELIVERY_DROPPED = Counter("cramjam_delivery_dropped_total", "Deliveries dropped for slow sessions")
+PUBLISH_TO_RENDER = Histogram(
+    "cramjam_publish_to_render_seconds", "From publish until a session has rendered the message"
+)
+PAGE_UPDATE_SECONDS = Histogram("cramjam_page_update_seconds", "page.update() duration", labels=("scope",))
+PAGE_UPDATE_CONTROLS = Histogram(
+    "cramjam_page_update_controls", "Controls sent per partial page.update()", buckets=SIZE_BUCKETS
+)
+USERS_DB_SECONDS = Histogram("cramjam_users_db_seconds", "UsersDB call latency", labels=("op",))
+
+
+# Export
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line each
+
+
+def _dump_forever(interval):
+    while True:
+        time.sleep(interval)
+        log.info("Metrics:\n%s", render())
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start_exporter(port=None, dump_seconds=None):
+    # Serves /metrics on localhost and/or logs every metric periodically,
+    # as configured. Safe to call more than once.
+    global _started
+    port = config.METRICS_PORT if port is None else port
+    dump_seconds = config.METRICS_DUMP_SECONDS if dump_seconds is None else dump_seconds
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    if port:
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+        except OSError as error:
+            log.warning("Metrics endpoint on port %s unavailable: %s", port, error)
+        else:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            log.info("Metrics at http://127.0.0.1:%s/metrics", port)
+    if dump_seconds:
+        threading.Thread(target=_dump_forever, args=(dump_seconds,), name="metrics-dump", daemon=True).start()
@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+
+ALGORITHM = "pbkdf2_sha256"
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password, salt=None, iterations=None):
+    # Returns "pbkdf2_sha256$<iterations>$<salt>$<hash>", so the cost can be
+    # raised later without invalidating stored hashes.
+    salt = salt or os.urandom(16)
+    iterations = iterations or config.KDF_ITERATIONS
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password, encoded):
+    try:
+        algorithm, iterations, salt, expected = encoded.split("$")
+    except ValueError:
+        return False
+    if algorithm != ALGORITHM:
+        return False
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), base64.b64decode(salt), int(iterations))
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+def needs_rehash(encoded):
+    # True for hashes made at a lower cost than configured, e.g. by an import
+    try:
+        return int(encoded.split("$")[1]) < config.KDF_ITERATIONS
+    except (IndexError, ValueError):
+        return True
+
+
+# The KDF is CPU bound, so it runs in worker processes to keep the GIL free
+# for the event handlers and the database threads. The pool is created from
+# a running, multithreaded server, where a plain fork can copy a lock held
+# by another thread into the child and deadlock it; workers are started from
+# a clean forkserver process instead (spawn where that is unavailable).
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _start_method():
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=config.KDF_WORKERS, mp_context=multiprocessing.get_context(_start_method())
+                )
+    return _pool
+
+
+def hash_password_offloaded(password):
+    return _get_pool().submit(hash_password, password).result()
+
+
+def verify_password_offloaded(password, encoded):
+    return _get_pool().submit(verify_password, password, encoded).result()
+
+
+def hash_passwords_offloaded(passwords):
+    # A whole batch, spread over the worker processes in a few chunks
+    chunksize = max(len(passwords) // (config.KDF_WORKERS * 4), 1)
+    return list(_get_pool().map(hash_password, passwords, chunksize=chunksize))
+
+
+class VerificationCache:
+    # Bounded, short-lived memory of successful verifications so repeated
+    # sign-ins and reconnects skip the KDF. Entries are keyed by an HMAC of
+    # (user, password, stored hash) under a per-process secret, so plaintext
+    # passwords are never kept and a password change invalidates the entry.
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = maxsize or config.VERIFY_CACHE_SIZE
+        self.ttl = ttl or config.VERIFY_CACHE_TTL
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()  # key -> expiry time
+        self._lock = threading.Lock()
+
+    def _key(self, user, password, encoded):
+        message = "\0".join((user, password, encoded)).encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def contains(self, user, password, encoded):
+        key = self._key(user, password, encoded)
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False
+            return True
+
+    def add(self, user, password, encoded):
+        key = self._key(user, password, encoded)
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
@@ -0,0 +1,133 @@
+import threading
+import uuid
+
+import config
+from chat_message import Message
+from hubs import get_hub_registry
+from update_scheduler import schedule_flush
+
+
+class Poll:
+    def __init__(self, poll_id, question, options, hub):
+        self.poll_id = poll_id
+        self.question = question
+        self.options = tuple(options)
+        self.hub = hub
+        self.counts = [0] * len(self.options)
+        self.voters = {}  # user -> option index
+        # Per poll, so votes on different polls never contend
+        self.lock = threading.Lock()
+
+
+class PollEngine:
+    # Polls are keyed by a generated id, so two polls with the same question
+    # stay separate. Each user gets one vote per poll. Votes mark the poll
+    # dirty, and dirty polls are broadcast to their hub as a "poll_results"
+    # message at most once per push interval.
+    def __init__(self, publish, interval_ms=None):
+        self.publish = publish  # Message -> None, must not persist it
+        self.interval = (interval_ms or config.POLL_PUSH_INTERVAL_MS) / 1000
+        self._polls = {}
+        self._dirty = set()
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def create(self, question, options, hub):
+        poll = Poll(uuid.uuid4().hex, question, options, hub)
+        with self._lock:
+            self._polls[poll.poll_id] = poll
+        return poll
+
+    def ensure(self, message: Message):
+        # Polls replayed from history after a restart start from zero votes
+        poll = self._polls.get(message.ref)
+        if poll is None:
+            with self._lock:
+                poll = self._polls.setdefault(
+                    message.ref, Poll(message.ref, message.text, message.attachments, message.hub)
+                )
+        return poll
+
+    def get(self, poll_id):
+        return self._polls.get(poll_id)
+
+    def polls(self):
+        with self._lock:
+            return list(self._polls.values())
+
+    def vote(self, poll_id, user, option):
+        # Returns False for unknown polls or options and for repeat voters.
+        poll = self._polls.get(poll_id)
+        if poll is None or option not in poll.options:
+            return False
+        index = poll.options.index(option)
+        with poll.lock:
+            if user in poll.voters:
+                return False
+            poll.voters[user] = index
+            poll.counts[index] += 1
+        self._changed(poll_id)
+        return True
+
+    def restore_votes(self, poll_id, voters):
+        # Adds votes counted elsewhere, {user: option index}, e.g. re-sent by
+        # workers after a broker restart. Voters already counted are skipped.
+        poll = self._polls[poll_id]
+        added = False
+        with poll.lock:
+            for user, index in voters.items():
+                if user not in poll.voters and 0 <= index < len(poll.options):
+                    poll.voters[user] = index
+                    poll.counts[index] += 1
+                    added = True
+        if added:
+            self._changed(poll_id)
+
+    def _changed(self, poll_id):
+        with self._lock:
+            self._dirty.add(poll_id)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        schedule_flush(self, self.interval)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._scheduled = False
+        for poll_id in dirty:
+            self.publish(self.results_message(self._polls[poll_id]))
+
+    def results_message(self, poll):
+        with poll.lock:
+            counts = tuple(str(count) for count in poll.counts)
+        return Message(
+            user="",
+            text="",
+            message_type="poll_results",
+            attachments=counts,
+            hub=poll.hub,
+            ref=poll.poll_id,
+        )
+
+
+def format_results(options, counts):
+    return "Results:\n" + "\n".join(f"{option}: {count} votes" for option, count in zip(options, counts))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_poll_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                hubs = get_hub_registry()
+                if config.PUBSUB_BACKEND == "broker":
+                    from broker import RemotePollEngine as engine_class  # broker imports this module
+                else:
+                    engine_class = PollEngine
+                _engine = engine_class(lambda message: hubs.publish(message, persist=False))
+    return _engine
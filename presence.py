@@ -0,0 +1,173 @@
+import threading
+
+import config
+import metrics
+from chat_message import Message
+from hubs import get_hub_registry
+from update_scheduler import schedule_flush
+
+_NAMES_SHOWN = 5  # Names spelled out in a join/leave notice
+_CHANGES_PER_MESSAGE = 1000  # Well within the wire format's attachment count
+SYNC = "sync"  # ref of notices that only re-sync the roster; not shown
+
+
+class PresenceTracker:
+    # Who is online in each hub. A user counts once per hub however many
+    # sessions they have open in it. Joins and leaves mark the hub dirty,
+    # and each dirty hub gets one "login_message" per push interval with the
+    # net changes since the last one, so a lecture signing in at once costs
+    # a few broadcasts instead of one per student. Attachments carry the
+    # changes as "+user" and "-user".
+    # Who is shown online comes from the notices received, applied once per
+    # process by apply(), not from this process's own sessions, so with the
+    # broker every worker sees the users of all workers. The roster counts
+    # the sources reporting each user: one here, one per worker with the
+    # broker.
+    def __init__(self, publish, interval_ms=None):
+        self.publish = publish  # Message -> None, must not persist it
+        self.interval = (interval_ms or config.PRESENCE_PUSH_INTERVAL_MS) / 1000
+        self._members = {}  # hub -> {user: open sessions here}
+        self._roster = {}  # hub -> {user: sources reporting them online}
+        self._members_list = {}  # hub -> sorted tuple of users, until the next change
+        self._changes = {}  # hub -> {user: +1 joined or -1 left since the last push}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def join(self, hub, user):
+        with self._lock:
+            members = self._members.setdefault(hub, {})
+            members[user] = members.get(user, 0) + 1
+            if members[user] == 1:
+                self._changed(hub, user, 1)
+
+    def leave(self, hub, user):
+        with self._lock:
+            members = self._members.get(hub)
+            if not members or user not in members:
+                return
+            members[user] -= 1
+            if members[user] == 0:
+                del members[user]
+                if not members:
+                    del self._members[hub]
+                self._changed(hub, user, -1)
+
+    def _changed(self, hub, user, change):
+        # Called under the lock. A join and a leave in one interval cancel out.
+        changes = self._changes.setdefault(hub, {})
+        if changes.pop(user, 0) + change == 0:
+            return
+        changes[user] = change
+        if not self._scheduled:
+            self._scheduled = True
+            schedule_flush(self, self.interval)
+
+    def apply(self, message):
+        # Listener for every transient message: takes in presence notices
+        if message.message_type != "login_message":
+            return
+        with self._lock:
+            roster = self._roster.setdefault(message.hub, {})
+            for change in message.attachments:
+                user = change[1:]
+                sources = roster.get(user, 0) + (1 if change[0] == "+" else -1)
+                if sources > 0:
+                    roster[user] = sources
+                else:
+                    roster.pop(user, None)
+            if not roster:
+                del self._roster[message.hub]
+            self._members_list.pop(message.hub, None)
+
+    def reset(self, roster):
+        # Replaces the roster, e.g. with the broker's on (re)connecting
+        with self._lock:
+            self._roster = {hub: dict(users) for hub, users in roster.items() if users}
+            self._members_list.clear()
+
+    def members_here(self):
+        # hub -> sorted users with a session in this process
+        with self._lock:
+            return {hub: sorted(members) for hub, members in self._members.items()}
+
+    def count(self, hub):
+        return len(self._roster.get(hub, ()))
+
+    def counts(self):
+        with self._lock:
+            return {hub: len(users) for hub, users in self._roster.items()}
+
+    def members(self, hub):
+        # Sorted online users, rebuilt only after the hub's membership changed
+        members = self._members_list.get(hub)
+        if members is None:
+            with self._lock:
+                members = self._members_list[hub] = tuple(sorted(self._roster.get(hub, ())))
+        return members
+
+    def flush(self):
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            self._scheduled = False
+        for hub, users in changes.items():
+            for message in presence_messages(hub, users):
+                try:
+                    self.publish(message)
+                except ConnectionError:
+                    # The broker is unreachable; the whole membership is
+                    # re-sent when the worker reconnects
+                    return
+
+
+def presence_messages(hub, changes, ref=""):
+    # {user: +1 or -1} as notices of at most _CHANGES_PER_MESSAGE changes
+    changes = list(changes.items())
+    for start in range(0, len(changes), _CHANGES_PER_MESSAGE):
+        yield presence_message(hub, dict(changes[start:start + _CHANGES_PER_MESSAGE]), ref)
+
+
+def presence_message(hub, changes, ref=""):
+    joined = sorted(user for user, change in changes.items() if change > 0)
+    left = sorted(user for user, change in changes.items() if change < 0)
+    parts = []
+    if joined:
+        parts.append(f"{_names(joined)} joined")
+    if left:
+        parts.append(f"{_names(left)} left")
+    return Message(
+        user="",
+        text=", ".join(parts),
+        message_type="login_message",
+        attachments=[f"+{user}" for user in joined] + [f"-{user}" for user in left],
+        hub=hub,
+        ref=ref,
+    )
+
+
+def _names(users):
+    if len(users) <= _NAMES_SHOWN:
+        return ", ".join(users)
+    others = len(users) - _NAMES_SHOWN
+    return f"{', '.join(users[:_NAMES_SHOWN])} and {others} other{'s' if others > 1 else ''}"
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_presence_tracker():
+    # Announces the sessions of this process; the notices reach every worker
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                hubs = get_hub_registry()
+                if config.PUBSUB_BACKEND == "broker":
+                    from broker import RemotePresenceTracker as tracker_class  # broker imports this module
+                else:
+                    tracker_class = PresenceTracker
+                tracker = tracker_class(lambda message: hubs.publish(message, persist=False))
+                hubs.add_listener(tracker.apply, transient=True)
+                metrics.HUB_ONLINE.function = tracker.counts
+                _tracker = tracker
+    return _tracker
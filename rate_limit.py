@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+class TokenBucket:
+    # Holds up to burst tokens, refilled at rate tokens per second.
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, now, cost=1):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter:
+    # One bucket per key, least recently used keys forgotten past max_keys
+    # (a forgotten key simply starts again with a full bucket).
+    def __init__(self, rate, burst, max_keys=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys or config.RATE_LIMIT_KEYS
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+
+class PublishLimiter:
+    # Checked before anything is published: a user may not flood any hub,
+    # and a hub as a whole may not outrun its subscribers.
+    def __init__(self):
+        self.users = RateLimiter(config.USER_PUBLISH_RATE, config.USER_PUBLISH_BURST)
+        self.hubs = RateLimiter(config.HUB_PUBLISH_RATE, config.HUB_PUBLISH_BURST)
+
+    def allow(self, user, hub):
+        # The user bucket is checked first so a flooding user does not also
+        # drain the hub's budget.
+        return self.users.allow(user) and self.hubs.allow(hub)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_publish_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = PublishLimiter()
+    return _limiter
@@ -0,0 +1,78 @@
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import config
+from chat_message import Message
+from event_store import get_event_store
+from hubs import get_hub_registry
+
+log = logging.getLogger(__name__)
+
+
+class ReminderScheduler:
+    # One background thread and a min-heap of (remind_at, event_id): adding
+    # an event is O(log n), and the thread sleeps until the earliest reminder
+    # is due instead of polling. Reminders go to the event's hub.
+    def __init__(self, store, publish, lead_minutes=None):
+        self.store = store
+        self.publish = publish  # Message -> None
+        self.lead = timedelta(minutes=config.REMINDER_LEAD_MINUTES if lead_minutes is None else lead_minutes)
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, event):
+        if event.all_day:
+            return
+        remind_at = (event.starts_at - self.lead).timestamp()
+        if event.starts_at.timestamp() <= time.time():
+            return
+        with self._cond:
+            heapq.heappush(self._heap, (remind_at, event.event_id))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-reminders", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                _, event_id = heapq.heappop(self._heap)
+            event = self.store.get(event_id)
+            if event is None:
+                continue
+            try:
+                self.publish(
+                    Message(
+                        user=event.created_by,
+                        text=f"⏰ Reminder: {event.name} starts at {event.starts_at:%H:%M}"
+                        + (f" ({event.venue})" if event.venue else ""),
+                        message_type="event_reminder",
+                        hub=event.hub,
+                        ref=event.event_id,
+                    )
+                )
+            except Exception:
+                log.exception("Reminder for %s failed", event.name)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_reminder_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                hubs = get_hub_registry()
+                # Reminders are transient, so they are not kept in hub history
+                _scheduler = ReminderScheduler(
+                    get_event_store(), lambda message: hubs.publish(message, persist=False)
+                )
+    return _scheduler
@@ -0,0 +1,132 @@
+import logging
+import weakref
+
+import flet as ft
+
+import user_style
+from chat_message import Message
+from polls import format_results, get_poll_engine
+
+log = logging.getLogger(__name__)
+
+# message_type -> renderer(message, context) returning a control. This is
+# the only place that decides how a message type looks.
+RENDERERS = {}
+
+# Older names still found in history and in ChatMessage callers
+ALIASES = {"text": "chat_message", "event": "event_message"}
+
+
+class RenderContext:
+    # Per-session hooks and state the renderers need
+    def __init__(self, vote=None, download=None, open_link=None):
+        self.vote = vote  # (poll_id, option) -> None
+        self.download = download  # (digest, file_name) -> None
+        self.open_link = open_link  # (url) -> None
+        # Result texts of rendered polls, patched in place as votes arrive
+        self.poll_result_texts = weakref.WeakValueDictionary()  # {poll_id: ft.Text}
+
+
+def renderer(*message_types):
+    def register(func):
+        for message_type in message_types:
+            RENDERERS[message_type] = func
+        return func
+
+    return register
+
+
+def render(message: Message, context: RenderContext):
+    func = RENDERERS.get(ALIASES.get(message.message_type, message.message_type))
+    if func is None:
+        log.warning("Unsupported message type: %s", message.message_type)
+        return None
+    return func(message, context)
+
+
+@renderer("chat_message")
+def render_chat(message: Message, context: RenderContext):
+    return ft.Text(
+        spans=[
+            ft.TextSpan(f"{message.user}: ", user_style.name_style(message.user)),
+            ft.TextSpan(message.text),
+        ],
+        color=ft.colors.BLACK,
+        size=14,
+    )
+
+
+@renderer("login_message")
+def render_login(message: Message, context: RenderContext):
+    return ft.Text(message.text, italic=True, color=ft.colors.WHITE, size=12)
+
+
+@renderer("file")
+def render_file(message: Message, context: RenderContext):
+    text = ft.Text(f"{message.user} sent a file: {message.text}", color=ft.colors.BLUE)
+    if context.download is None:
+        return text
+    return ft.Column(
+        [
+            text,
+            ft.Row(
+                [
+                    ft.TextButton(
+                        text=attachment,
+                        on_click=lambda e, a=attachment: context.download(message.ref, a),
+                    )
+                    for attachment in message.attachments
+                ]
+            ),
+        ],
+        tight=True,
+        spacing=5,
+    )
+
+
+@renderer("poll")
+def render_poll(message: Message, context: RenderContext):
+    poll = get_poll_engine().ensure(message)
+    poll_controls = [ft.Text(f"Poll: {poll.question}", weight=ft.FontWeight.BOLD, size=16)]
+    for option in poll.options:
+        poll_controls.append(
+            ft.ElevatedButton(
+                text=option,
+                on_click=lambda e, opt=option: context.vote(poll.poll_id, opt),
+                disabled=context.vote is None,
+            )
+        )
+
+    # Display poll results; later votes patch only this text
+    results = ft.Text(format_results(poll.options, poll.counts), italic=True, size=14)
+    context.poll_result_texts[poll.poll_id] = results
+    poll_controls.append(results)
+
+    return ft.Column(poll_controls, spacing=5)
+
+
+@renderer("event_message")
+def render_event(message: Message, context: RenderContext):
+    return ft.Text(message.text, weight=ft.FontWeight.BOLD, size=14, color=ft.colors.GREEN)
+
+
+@renderer("event_reminder")
+def render_event_reminder(message: Message, context: RenderContext):
+    return ft.Text(message.text, italic=True, color=ft.colors.ORANGE, size=14)
+
+
+@renderer("link")
+def render_link(message: Message, context: RenderContext):
+    return ft.Column(
+        [
+            ft.Text(message.user, weight="bold"),
+            ft.Text(f"Resource Link: {message.text}", selectable=True),
+            ft.TextButton(
+                text="Open Link",
+                on_click=lambda e: context.open_link(message.text),
+                disabled=context.open_link is None,
+            ),
+        ],
+        tight=True,
+        spacing=5,
+    )
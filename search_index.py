@@ -0,0 +1,229 @@
+import heapq
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left, insort
+from datetime import datetime
+
+import config
+from hubs import get_hub_registry
+
+_WORD = re.compile(r"\w+")
+_FIELDS = ("user", "hub", "type")
+_MAX_PREFIX_TERMS = 64  # Terms a single prefix may expand to
+_POSTING_BYTES = 4  # One array("I") entry
+_TERM_BYTES = 100  # Dict slot, key string and empty array, roughly
+_DOC_BYTES = 150  # Dict slot, terms tuple and bookkeeping, roughly
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+def parse_query(query):
+    # "exam user:ann after:2026-10-01" -> (["exam"], {"user": "ann"}, since, until)
+    words, filters, since, until = [], {}, None, None
+    for part in query.split():
+        field, _, value = part.partition(":")
+        field = field.lower()
+        if value and field in _FIELDS:
+            filters[field] = value.lower()
+        elif value and field in ("after", "before"):
+            try:
+                stamp = datetime.fromisoformat(value).timestamp()
+            except ValueError:
+                words.extend(tokenize(part))
+                continue
+            if field == "after":
+                since = stamp
+            else:
+                until = stamp
+        else:
+            words.extend(tokenize(part))
+    return words, filters, since, until
+
+
+class SearchIndex:
+    # Incremental inverted index over published messages. Documents get
+    # ascending ids in publish order, and every posting list is an ascending
+    # array("I"), so newest-first paging walks one list backwards and checks
+    # the others with bisect. user, hub and type are indexed as "user:<name>"
+    # style terms, which makes them ordinary filters. When the estimated size
+    # passes the memory budget, the oldest documents are dropped.
+    # Ids must follow publish order, so with backfilling=True live messages
+    # are held until backfill() has indexed the retained history, oldest
+    # first across all hubs.
+    def __init__(self, memory_budget=None, backfilling=False):
+        self.memory_budget = memory_budget or config.SEARCH_MEMORY_BYTES
+        self._postings = {}  # term -> array("I") of doc ids
+        self._vocabulary = []  # sorted terms, for prefix lookups
+        self._docs = {}  # doc id -> (Message, terms)
+        self._next_id = 0
+        self._first_id = 0  # Lower ids have been evicted
+        self._pending = [] if backfilling else None  # Live messages held during the backfill
+        self._backfilled_to = {}  # hub -> last seq backfilled, so it is not indexed twice
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, message):
+        # Listener for every persisted message
+        terms = _terms(message)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(message)
+                return
+            self._add(message, terms)
+
+    def _add(self, message, terms):
+        # Called under the lock
+        if message.seq <= self._backfilled_to.get(message.hub, 0):
+            return
+        doc_id = self._next_id
+        self._next_id += 1
+        self._docs[doc_id] = (message, terms)
+        self._bytes += _DOC_BYTES + sys.getsizeof(message.text) + _POSTING_BYTES * len(terms)
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = array("I")
+                insort(self._vocabulary, term)
+                self._bytes += _TERM_BYTES + len(term)
+            posting.append(doc_id)
+        if self._bytes > self.memory_budget:
+            self._evict(max(len(self._docs) // 10, 1))
+
+    def _evict(self, count):
+        # Drop the oldest documents and trim them from the front of their
+        # posting lists; terms left with no postings are forgotten.
+        stop = self._first_id + count
+        touched = set()
+        for doc_id in range(self._first_id, stop):
+            entry = self._docs.pop(doc_id, None)
+            if entry is None:
+                continue
+            message, terms = entry
+            self._bytes -= _DOC_BYTES + sys.getsizeof(message.text) + _POSTING_BYTES * len(terms)
+            touched.update(terms)
+        self._first_id = stop
+        for term in touched:
+            posting = self._postings[term]
+            del posting[: bisect_left(posting, stop)]
+            if not posting:
+                del self._postings[term]
+                del self._vocabulary[bisect_left(self._vocabulary, term)]
+                self._bytes -= _TERM_BYTES + len(term)
+
+    def _expand(self, prefix):
+        start = bisect_left(self._vocabulary, prefix)
+        matches = []
+        for term in self._vocabulary[start:start + _MAX_PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            matches.append(self._postings[term])
+        return matches
+
+    def search(self, query, page=0, page_size=None, hub=None):
+        # Returns (messages newest first, has_more). Every word matches as a
+        # prefix, e.g. "calc" finds "calculus".
+        page_size = page_size or config.SEARCH_PAGE_SIZE
+        words, filters, since, until = parse_query(query)
+        if hub and "hub" not in filters:
+            filters["hub"] = hub.lower()
+        with self._lock:
+            groups = [self._expand(word) for word in words]
+            for field, value in filters.items():
+                posting = self._postings.get(f"{field}:{value}")
+                groups.append([posting] if posting is not None else [])
+            if not groups or any(not group for group in groups):
+                return [], False
+            # Drive from the group with the fewest candidates
+            groups.sort(key=lambda group: sum(len(posting) for posting in group))
+            driver, others = groups[0], groups[1:]
+            candidates = sorted(set().union(*driver), reverse=True) if len(driver) > 1 else reversed(driver[0])
+            skip = page * page_size
+            results = []
+            for doc_id in candidates:
+                if not all(_contains_any(group, doc_id) for group in others):
+                    continue
+                message = self._docs[doc_id][0]
+                if (since is not None and message.sent_at < since) or (until is not None and message.sent_at >= until):
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                if len(results) == page_size:
+                    return results, True
+                results.append(message)
+            return results, False
+
+    def backfill(self, hubs, batch=1000):
+        # Index the history retained on disk, e.g. at startup, merged across
+        # hubs in publish order, then the live messages held meanwhile.
+        try:
+            histories = [_history(hubs, hub, batch) for hub in hubs.known_hubs()]
+            for message in heapq.merge(*histories, key=_publish_order):
+                terms = _terms(message)
+                with self._lock:
+                    self._add(message, terms)
+                    self._backfilled_to[message.hub] = message.seq
+        finally:
+            with self._lock:
+                pending, self._pending = self._pending or [], None
+                for message in sorted(pending, key=_publish_order):
+                    self._add(message, _terms(message))
+
+
+def _terms(message):
+    terms = set(tokenize(message.text))
+    terms.update(
+        (
+            f"user:{message.user.lower()}",
+            f"hub:{message.hub.lower()}",
+            f"type:{message.message_type.lower()}",
+        )
+    )
+    return tuple(terms)
+
+
+def _publish_order(message):
+    return message.sent_at, message.hub, message.seq
+
+
+def _history(hubs, hub, batch):
+    # A hub's retained messages, read a batch at a time
+    first, end = hubs.with_log(hub, lambda log: (log.first_seq, log.last_seq + 1))
+    for start in range(first, end, batch):
+        stop = min(start + batch, end)
+        yield from hubs.with_log(hub, lambda log: log.read_range(start, stop))
+
+
+def _contains_any(postings, doc_id):
+    for posting in postings:
+        index = bisect_left(posting, doc_id)
+        if index < len(posting) and posting[index] == doc_id:
+            return True
+    return False
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    # Created on first use; indexes every persisted message from then on and
+    # backfills retained history in the background.
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                hubs = get_hub_registry()
+                _index = SearchIndex(backfilling=True)
+                hubs.add_listener(_index.add)
+                threading.Thread(
+                    target=_index.backfill, args=(hubs,), name="search-backfill", daemon=True
+                ).start()
+    return _index
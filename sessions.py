@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import metrics
+from update_scheduler import schedule_flush
+
+log = logging.getLogger(__name__)
+
+# Rough per-session costs, measured with benchmarks/load_test.py
+_SIGNIN_BYTES = 32 * 1024  # A session showing only the sign-in form
+_CHAT_BYTES = 48 * 1024  # The chat views on top of that, with no messages
+_MESSAGE_BYTES = 2 * 1024  # Each rendered message control
+
+
+def estimate_bytes(live_messages=None):
+    # live_messages is None while the chat views have not been built
+    if live_messages is None:
+        return _SIGNIN_BYTES
+    return _SIGNIN_BYTES + _CHAT_BYTES + _MESSAGE_BYTES * live_messages
+
+
+class _Session:
+    __slots__ = ("session_id", "evict", "footprint", "last_active", "connected", "evicted")
+
+    def __init__(self, session_id, evict, footprint):
+        self.session_id = session_id
+        self.evict = evict  # reason -> None; releases what the session holds
+        self.footprint = footprint  # () -> estimated bytes
+        self.last_active = time.monotonic()
+        self.connected = True
+        self.evicted = False
+
+
+class SessionRegistry:
+    # Tracks every open session's last user activity and estimated memory.
+    # A periodic sweep on the update workers evicts sessions idle for longer
+    # than the timeout, then, while the estimated total is over budget,
+    # disconnected sessions and the least recently active ones. Evicting unsubscribes the
+    # session and drops its views; the page itself goes when Flet closes it.
+    def __init__(self, idle_seconds=None, memory_budget=None, sweep_seconds=None):
+        self.idle_seconds = idle_seconds or config.SESSION_IDLE_SECONDS
+        self.memory_budget = memory_budget or config.SESSION_MEMORY_BYTES
+        self.sweep_seconds = sweep_seconds or config.SESSION_SWEEP_SECONDS
+        self._sessions = OrderedDict()  # session_id -> _Session, least recently active first
+        self._bytes = 0  # Sessions not evicted, as of the last sweep
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def estimated_bytes(self):
+        return self._bytes
+
+    def open(self, session_id, evict, footprint):
+        with self._lock:
+            self._sessions[session_id] = _Session(session_id, evict, footprint)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        schedule_flush(self, self.sweep_seconds)
+
+    def touch(self, session_id):
+        # Called on user activity; also brings an evicted session back
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_active = time.monotonic()
+                session.connected = True
+                session.evicted = False
+                self._sessions.move_to_end(session_id)
+
+    def disconnected(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.connected = False
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None and not session.evicted:
+            session.evict("closed")
+
+    def flush(self):
+        # The periodic sweep, run on an update worker
+        try:
+            self.sweep()
+        finally:
+            schedule_flush(self, self.sweep_seconds)
+
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        for session in self._live():
+            if now - session.last_active > self.idle_seconds:
+                self._evict(session, "idle")
+        total = sum(session.footprint() for session in self._live())
+        if total > self.memory_budget:
+            # Disconnected sessions go first, then in order of last activity
+            candidates = sorted(self._live(), key=lambda s: s.connected)
+            for session in candidates:
+                if total <= self.memory_budget:
+                    break
+                total -= session.footprint()
+                self._evict(session, "memory")
+        self._bytes = total
+
+    def _live(self):
+        with self._lock:
+            return [session for session in self._sessions.values() if not session.evicted]
+
+    def _evict(self, session, reason):
+        session.evicted = True
+        metrics.SESSIONS_EVICTED.inc(reason)
+        try:
+            session.evict(reason)
+        except Exception:
+            log.exception("Could not evict session %s", session.session_id)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_session_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = SessionRegistry()
+                metrics.ACTIVE_SESSIONS.function = lambda: len(registry)
+                metrics.SESSION_MEMORY.function = registry.estimated_bytes
+                _registry = registry
+    return _registry
@@ -1,5 +1,5 @@
 import flet as ft
-from users_db import UsersDB  # Import the MongoDB helper class
+from users_db import get_users_db  # Shared, pooled database client
 
 # SignIn Form
 class SignInForm(ft.UserControl):
@@ -7,7 +7,6 @@ class SignInForm(ft.UserControl):
         super().__init__()
         self.submit_values = submit_values  # Callback for valid credentials
         self.btn_signup = btn_signup  # Route to Sign Up Form
-        self.db = UsersDB()  # Initialize database connection
 
     def btn_signin(self, e):
         if not self.text_user.value:
@@ -19,13 +18,34 @@ class SignInForm(ft.UserControl):
             self.text_password.update()
             return
 
-        # Check credentials in MongoDB
-        if self.db.find_user(self.text_user.value, self.text_password.value):
-            self.submit_values(self.text_user.value, self.text_password.value)
+        # Check credentials in MongoDB off the event handler thread
+        user, password = self.text_user.value, self.text_password.value
+        self.set_pending(True)
+        try:
+            db = get_users_db()
+        except Exception as error:  # The client could not be created, e.g. database down
+            self.on_signin_result(user, password, None, error)
+            return
+        db.find_user_async(user, password, lambda found, error: self.on_signin_result(user, password, found, error))
+
+    def on_signin_result(self, user, password, found, error):
+        self.set_pending(False)
+        if error is not None:
+            self.text_user.error_text = "Could not sign in, please try again!"
+            self.text_user.update()
+        elif found:
+            self.submit_values(user, password)
         else:
             self.text_user.error_text = "Invalid username or password!"
             self.text_user.update()
 
+    def set_pending(self, pending):
+        self.text_signin.disabled = pending
+        self.text_signin.text = "Signing in..." if pending else "Sign in"
+        if pending:
+            self.text_user.error_text = None
+        self.update()
+
     def build(self):
         self.signin_image = ft.Container(
             content=ft.Icon(name=ft.icons.PERSON, color=ft.colors.BLUE, size=100),
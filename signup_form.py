@@ -1,5 +1,6 @@
 import flet as ft
-from users_db import UsersDB  # Import the MongoDB helper class
+import config
+from users_db import get_users_db  # Shared, pooled database client
 
 # SignUp Form
 class SignUpForm(ft.UserControl):
@@ -7,25 +8,49 @@ class SignUpForm(ft.UserControl):
         super().__init__()
         self.submit_values = submit_values  # Callback for successful signup
         self.btn_signin = btn_signin  # Route to Sign In Form
-        self.db = UsersDB()  # Initialize database connection
 
     def btn_signup(self, e):
         if not self.text_user.value:
             self.text_user.error_text = "Name cannot be blank!"
             self.text_user.update()
             return
+        if len(self.text_user.value) > config.USER_NAME_MAX_LENGTH:
+            self.text_user.error_text = f"Name cannot be longer than {config.USER_NAME_MAX_LENGTH} characters!"
+            self.text_user.update()
+            return
         if not self.text_password.value:
             self.text_password.error_text = "Password cannot be blank!"
             self.text_password.update()
             return
 
-        # Add user to MongoDB
-        if self.db.add_user(self.text_user.value, self.text_password.value):
-            self.submit_values(self.text_user.value, self.text_password.value)
+        # Add user to MongoDB off the event handler thread
+        user, password = self.text_user.value, self.text_password.value
+        self.set_pending(True)
+        try:
+            db = get_users_db()
+        except Exception as error:  # The client could not be created, e.g. database down
+            self.on_signup_result(user, password, None, error)
+            return
+        db.add_user_async(user, password, lambda added, error: self.on_signup_result(user, password, added, error))
+
+    def on_signup_result(self, user, password, added, error):
+        self.set_pending(False)
+        if error is not None:
+            self.text_user.error_text = "Could not sign up, please try again!"
+            self.text_user.update()
+        elif added:
+            self.submit_values(user, password)
         else:
             self.text_user.error_text = "User already exists!"
             self.text_user.update()
 
+    def set_pending(self, pending):
+        self.text_signup.disabled = pending
+        self.text_signup.text = "Signing up..." if pending else "Sign up"
+        if pending:
+            self.text_user.error_text = None
+        self.update()
+
     def build(self):
         self.title_form = ft.Text(
             value="Create your account", text_align=ft.TextAlign.CENTER, size=30
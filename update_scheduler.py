@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class UpdateScheduler:
+    # Coalesces page.update() calls for one session. request() marks controls
+    # (or the whole page) dirty and schedules a single flush at most one frame
+    # interval later; flush() pushes pending changes right away for
+    # latency-sensitive actions. A session has at most one scheduled flush
+    # pending or running, so a slow client ties up one update worker at most,
+    # and flushes of one session never overlap: flush() waits for a running
+    # one, and only the scheduled flush clears the scheduled flag.
+    # lag() is how long the oldest change not yet sent has been waiting. It
+    # grows while this session's page.update() calls are slow or failing,
+    # and deliveries to the session back off on it. A failed flush is
+    # retried with exponential backoff until one gets through, so the lag
+    # always comes back down without waiting for another request().
+    def __init__(self, page, interval_ms=None, max_lag_ms=None, retry_max_ms=None):
+        self.page = page
+        self.interval = (interval_ms or config.UPDATE_INTERVAL_MS) / 1000
+        self.max_lag = (max_lag_ms or config.SESSION_MAX_LAG_MS) / 1000
+        self.retry_max = (retry_max_ms or config.UPDATE_RETRY_MAX_MS) / 1000
+        self._retry = self.interval  # Delay before retrying a failed flush
+        self._closed = False
+        self._dirty = {}  # id(control) -> control
+        self._full = False
+        self._on_sent = []  # Called once the changes requested with them are sent
+        self._scheduled = False  # A flush is scheduled or running
+        self._waiting_since = None  # When the oldest unsent change was requested
+        self._timer = _Timer(self._scheduled_flush)  # What the ticker runs
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Held while sending
+        # Held while page.update() runs. Flet diffs child lists in place, so
+        # code that adds or removes children of controls on this page from
+        # another thread, e.g. deliveries, must hold it too.
+        self.controls_lock = threading.RLock()
+
+    def request(self, *controls, on_sent=None):
+        # on_sent() is called after the page.update() that carries these
+        # changes, e.g. to time how long a message took to reach the client
+        with self._lock:
+            if controls:
+                for control in controls:
+                    self._dirty[id(control)] = control
+            else:
+                self._full = True
+            if on_sent is not None:
+                self._on_sent.append(on_sent)
+            if self._waiting_since is None:
+                self._waiting_since = time.monotonic()
+            if self._scheduled or self._closed:
+                return
+            self._scheduled = True
+        schedule_flush(self._timer, self.interval)
+
+    def close(self):
+        # The session is gone: nothing more is scheduled or retried
+        with self._lock:
+            self._closed = True
+
+    def lag(self):
+        waiting_since = self._waiting_since
+        return 0.0 if waiting_since is None else time.monotonic() - waiting_since
+
+    def keeping_up(self):
+        return self.lag() <= self.max_lag
+
+    def flush(self):
+        # Sends pending changes now, after any flush already running for
+        # this session, which may have sent them
+        with self._flush_lock:
+            self._send(scheduled=False)
+
+    def _scheduled_flush(self):
+        with self._flush_lock:
+            self._send(scheduled=True)
+
+    def _send(self, scheduled):
+        with self._lock:
+            full, dirty, on_sent = self._full, list(self._dirty.values()), self._on_sent
+            self._full = False
+            self._dirty.clear()
+            self._on_sent = []
+        flushed_at = time.monotonic()
+        started = time.perf_counter()
+        try:
+            with self.controls_lock:
+                if full:
+                    self.page.update()
+                    metrics.PAGE_UPDATE_SECONDS.observe(time.perf_counter() - started, "full")
+                else:
+                    # Controls that are not on the page yet (e.g. the chat
+                    # before sign-in) are sent in full when they get mounted.
+                    dirty = [control for control in dirty if control.page is not None]
+                    if dirty:
+                        self.page.update(*dirty)
+                        metrics.PAGE_UPDATE_SECONDS.observe(time.perf_counter() - started, "partial")
+                        metrics.PAGE_UPDATE_CONTROLS.observe(len(dirty))
+        except Exception:
+            # Retried after a growing delay, by the scheduled flush if one is
+            # pending; the lag keeps counting until then
+            with self._lock:
+                self._full = self._full or full
+                for control in dirty:
+                    self._dirty.setdefault(id(control), control)
+                self._on_sent[:0] = on_sent
+                retrying = not self._closed and (scheduled or not self._scheduled)
+                if retrying:
+                    retry, self._retry = self._retry, min(self._retry * 2, self.retry_max)
+                    self._scheduled = True
+                elif scheduled:
+                    self._scheduled = False
+            if retrying:
+                schedule_flush(self._timer, retry)
+            raise
+        if full or dirty:
+            # Dropped when nothing was sent, e.g. the chat is not on the page yet
+            for callback in on_sent:
+                callback()
+        with self._lock:
+            self._retry = self.interval
+            # Changes requested while this one was being sent are still waiting
+            waiting = self._full or bool(self._dirty)
+            self._waiting_since = flushed_at if waiting else None
+            if not scheduled:
+                return  # A scheduled flush, if any, is still pending
+            if not waiting or self._closed:
+                self._scheduled = False
+                return
+        schedule_flush(self._timer, self.interval)
+
+
+class _Timer:
+    # Handed to the ticker in place of the scheduler, so that the ticker's
+    # flush() is told apart from explicit UpdateScheduler.flush() calls
+    __slots__ = ("flush",)
+
+    def __init__(self, flush):
+        self.flush = flush
+
+
+class _Ticker:
+    # One daemon thread keeps the schedule, so a burst costs no thread or
+    # timer per update. Due flushes run on a small worker pool rather than
+    # on the ticker itself: a flush that blocks, like a slow client's
+    # page.update() or a catch-up reading the disk or waiting on the broker,
+    # then holds up only its own session, not every timer in the process.
+    def __init__(self, workers=None):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers or config.UPDATE_WORKERS, thread_name_prefix="update-worker"
+        )
+
+    def schedule(self, scheduler, due):
+        if due <= time.monotonic():
+            self._pool.submit(self._flush, scheduler)
+            return
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._counter), scheduler))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="update-ticker", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, scheduler = heapq.heappop(self._heap)
+            self._pool.submit(self._flush, scheduler)
+
+    @staticmethod
+    def _flush(scheduler):
+        try:
+            scheduler.flush()
+        except Exception:
+            log.exception("Scheduled update failed")
+
+
+_ticker = _Ticker()
+
+
+def schedule_flush(target, delay):
+    # Calls target.flush() on the shared update workers after delay seconds.
+    _ticker.schedule(target, time.monotonic() + delay)
@@ -0,0 +1,49 @@
+import zlib
+from functools import lru_cache
+
+import flet as ft
+
+import config
+
+# Per-user display data, derived once per user instead of once per message.
+
+AVATAR_COLORS = (
+    ft.colors.AMBER, ft.colors.BLUE, ft.colors.BROWN, ft.colors.CYAN,
+    ft.colors.GREEN, ft.colors.INDIGO, ft.colors.LIME, ft.colors.ORANGE,
+    ft.colors.PINK, ft.colors.PURPLE, ft.colors.RED, ft.colors.TEAL, ft.colors.YELLOW,
+)
+
+NO_PROFILE_TOOLTIP = "No profile details available."
+
+
+@lru_cache(maxsize=config.USER_STYLE_CACHE_SIZE)
+def initials(user: str):
+    return user[:1].capitalize()
+
+
+@lru_cache(maxsize=config.USER_STYLE_CACHE_SIZE)
+def avatar_color(user: str):
+    # crc32 rather than hash(): str hashes are salted per process, which gave
+    # a user different colours on different workers and after restarts.
+    return AVATAR_COLORS[zlib.crc32(user.encode()) % len(AVATAR_COLORS)]
+
+
+@lru_cache(maxsize=config.USER_STYLE_CACHE_SIZE)
+def name_style(user: str):
+    # TextStyle is plain data, so one instance can be shared by every span
+    return ft.TextStyle(color=avatar_color(user), weight=ft.FontWeight.BOLD)
+
+
+def profile_tooltip(profile):
+    if not profile:
+        return NO_PROFILE_TOOLTIP
+    return _profile_tooltip(
+        profile.get("major", "Unknown"),
+        profile.get("year", "Unknown"),
+        tuple(profile.get("interests", ())),
+    )
+
+
+@lru_cache(maxsize=config.USER_STYLE_CACHE_SIZE)
+def _profile_tooltip(major, year, interests):
+    return f"Major: {major}\nYear: {year}\nInterests: {', '.join(interests)}"